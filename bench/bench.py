@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#Copyright (c) 2020, University Corporation for Atmospheric Research
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without 
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, 
+#this list of conditions and the following disclaimer.
+#
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#3. Neither the name of the copyright holder nor the names of its contributors
+#may be used to endorse or promote products derived from this software without
+#specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+#LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+#WHETHER IN CONTRACT, STRICT LIABILITY,
+#OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+
+#Times the real ctt entry points against a synthetic database and prints JSON.
+#
+#  ./bench/bench.py                          # 100k issues, 20 history and 10 comments per issue
+#  ./bench/bench.py --issues 20000 --repeat 5 -o bench_output.txt
+#  ./bench/bench.py --workdir /tmp/ctt-bench --reuse --cases list,list_vv,auto
+#
+#Every case runs ctt.py in a fresh python process, the way cron and admins do, so the numbers
+#include interpreter startup, ctt.ini parsing and checkdb(). Cases that write to the database
+#start from the same pristine copy each time. --auto runs against a replay snapshot
+#(see replay/run_replay.py) that covers every node in the database.
+import argparse
+import getpass
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.dirname(benchdir)
+replaydir = os.path.join(topdir, 'replay')
+ctt = os.path.join(topdir, 'ctt.py')
+sys.path.insert(0, benchdir)
+sys.path.insert(0, replaydir)
+from gen_db import generate as generate_db
+from gen_snapshots import generate as generate_snapshots
+
+ini = '''[DEFAULTS]
+severity = 3
+issuestatus = open
+issuetype = h
+assignedto = hsg
+pbsadmin = bench-pbs
+pbsnodes_path = {replaydir}/pbsnodes
+clush_path = {replaydir}/clush
+attach_location = {workdir}/attachments
+cluster = casper
+maxissuesrun = 100000
+maxissuesopen = 100000
+strict_node_match = False
+strict_node_match_auto = False
+pbs_enforcement = True
+badnode_timeout = 30
+maxcommands = 8
+
+[USERS]
+hsg = {user}
+casg = lmyers dread
+'''
+
+
+def pick_issues(path):	#issue numbers the cases work on
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    cur.execute('''SELECT cttissue FROM issues WHERE status = ? ORDER BY id''', ('open',))
+    openissues = [row[0] for row in cur.fetchall()]
+    cur.execute('''SELECT DISTINCT cttissue FROM siblings WHERE status = ? ORDER BY cttissue''', ('open',))
+    withsibs = [row[0] for row in cur.fetchall()]
+    cur.execute('''SELECT cttissue FROM history GROUP BY cttissue ORDER BY COUNT(*) DESC LIMIT 1''')
+    busiest = cur.fetchone()[0]
+    con.close()
+    return openissues, withsibs, busiest
+
+
+def cases(openissues, withsibs, busiest):	#name: (ctt arguments, writes to the database)
+    plain = [issue for issue in openissues if issue not in withsibs]
+    return {
+        'list': (['--list'], False),
+        'list_v': (['--list', '-v'], False),
+        'list_vv': (['--list', '-vv'], False),
+        'list_all': (['--list', '-s', 'all'], False),
+        'show_d': (['--show', busiest, '-d'], False),
+        'update_list': (['--update', ','.join(plain[:50]), '-s', '2', '-a', 'casg', '-i', 'bench title', '-d', 'bench description'], True),
+        'close_siblings': (['--close', withsibs[0], 'bench close'], True),
+        'stats_counts': (['--stats', '-c'], False),
+        'auto': (['--auto'], True),
+    }
+
+
+def run_ctt(workdir, args):
+    env = dict(os.environ, CTT_REPLAY_DIR=workdir)
+    start = time.time()
+    proc = subprocess.run([sys.executable, '-W', 'ignore', ctt] + args, cwd=workdir, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return time.time() - start, proc.returncode, len(proc.stdout), proc.stderr.decode(errors='replace')[-500:]
+
+
+def restore(workdir):
+    shutil.copy(os.path.join(workdir, 'ctt.sqlite.pristine'), os.path.join(workdir, 'ctt.sqlite'))
+    for name in ('cursor.json', 'overlay.json', 'requests.log', 'ctt.sqlite-wal', 'ctt.sqlite-shm'):
+        if os.path.exists(os.path.join(workdir, name)):
+            os.unlink(os.path.join(workdir, name))
+
+
+def setup(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ctt-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, 'ctt.ini'), 'w') as f:
+        f.write(ini.format(replaydir=replaydir, workdir=workdir, user=getpass.getuser()))
+    meta = {}
+    pristine = os.path.join(workdir, 'ctt.sqlite.pristine')
+    if not (args.reuse and os.path.exists(pristine)):
+        start = time.time()
+        generate_db(os.path.join(workdir, 'ctt.sqlite'), args.issues, args.history, args.comments,
+                    args.open, args.sibling_issues, args.racks, args.seed)
+        meta['generate_seconds'] = round(time.time() - start, 3)
+        #first ctt command against the old schema runs checkdb() and all migrations
+        seconds, returncode, outbytes, stderr = run_ctt(workdir, ['--list'])
+        meta['migrate_seconds'] = round(seconds, 3)
+        shutil.copy(os.path.join(workdir, 'ctt.sqlite'), pristine)
+        shutil.rmtree(os.path.join(workdir, 'snapshots'), ignore_errors=True)
+        with open(os.path.join(workdir, 'replay.json'), 'w') as f:
+            json.dump({'latency': 0}, f)
+        generate_snapshots(workdir, nodes=args.racks * 8 * 36, steps=1, fail_rate=0.002, seed=args.seed)
+    restore(workdir)
+    return workdir, meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ctt entry points, results as JSON')
+    parser.add_argument('--workdir', help='scratch directory, default a new temporary directory')
+    parser.add_argument('--reuse', action='store_true', help='reuse the database already generated in --workdir')
+    parser.add_argument('--issues', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=20, help='history rows per issue')
+    parser.add_argument('--comments', type=int, default=10, help='comments per issue')
+    parser.add_argument('--open', type=int, default=500, help='open issues')
+    parser.add_argument('--sibling-issues', type=int, default=1000)
+    parser.add_argument('--racks', type=int, default=40, help='racks of 288 nodes, also the --auto snapshot size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', help='comma separated subset of cases to run')
+    parser.add_argument('-o', '--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    workdir, meta = setup(args)
+    allcases = cases(*pick_issues(os.path.join(workdir, 'ctt.sqlite')))
+    selected = args.cases.split(',') if args.cases else list(allcases)
+    results = {}
+    for name in selected:
+        cttargs, writes = allcases[name]
+        timings = []
+        for i in range(args.repeat):
+            if writes:
+                restore(workdir)
+            seconds, returncode, outbytes, stderr = run_ctt(workdir, cttargs)
+            timings.append(seconds)
+            if returncode != 0:
+                results[name] = {'error': stderr, 'returncode': returncode}
+                break
+        else:
+            timings.sort()
+            results[name] = {'min': round(timings[0], 4), 'median': round(timings[len(timings) // 2], 4),
+                             'max': round(timings[-1], 4), 'runs': len(timings), 'output_bytes': outbytes}
+    restore(workdir)
+
+    con = sqlite3.connect(os.path.join(workdir, 'ctt.sqlite'))
+    for table in ('issues', 'history', 'comments', 'siblings'):
+        meta[table] = con.execute('SELECT COUNT(*) FROM %s' % (table)).fetchone()[0]
+    con.close()
+    git = subprocess.run(['git', '-C', topdir, 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    meta.update({'workdir': workdir, 'git': git, 'python': platform.python_version(),
+                 'sqlite': sqlite3.sqlite_version, 'repeat': args.repeat, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    report = json.dumps({'meta': meta, 'results': results}, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
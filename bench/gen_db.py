@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#Copyright (c) 2020, University Corporation for Atmospheric Research
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without 
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, 
+#this list of conditions and the following disclaimer.
+#
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#3. Neither the name of the copyright holder nor the names of its contributors
+#may be used to endorse or promote products derived from this software without
+#specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+#LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+#WHETHER IN CONTRACT, STRICT LIABILITY,
+#OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+
+#Builds a synthetic ctt.sqlite for the benchmarks in bench.py.
+#
+#  ./bench/gen_db.py /tmp/ctt-bench/ctt.sqlite --issues 100000 --history 20 --comments 10
+#
+#The database is written with the original (user_version 0) ctt schema, like a tracker that
+#has been in production for years, so the first ctt command run against it also exercises
+#checkdb() and every schema migration.
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+
+groups = ['hsg', 'casg']
+users = ['root', 'robertsj', 'jbaker', 'lmyers', 'dread', 'ctt']
+parts = ['P1-DIMM1A', 'P2-DIMM1G', 'P1-DIMM2C', 'CPU1', 'CPU2', 'HCA0', 'PSU1', 'BMC']
+problems = ['Persistent memory errors on', 'Correctable ECC storm on', 'Machine check on', 'Link flapping on',
+            'Replace failed', 'Will not boot, suspect', 'Thermal trip on', 'Firmware update needed for']
+start = datetime.datetime(2018, 1, 1)
+states = ['free', 'job-busy', 'offline', 'down,offline', 'state-unknown,down']
+
+
+def create_schema(cur):	#ctt schema before any migration
+    cur.execute('''CREATE TABLE issues(
+            id INTEGER PRIMARY KEY, cttissue TEXT NOT NULL, date TEXT NOT NULL, severity INT NOT NULL,
+            ticket TEXT, status TEXT NOT NULL, cluster TEXT NOT NULL, hostname TEXT NOT NULL,
+            issuetitle TEXT NOT NULL, issuedescription TEXT NOT NULL, assignedto TEXT,
+            issueoriginator TEXT NOT NULL, updatedby TEXT NOT NULL, issuetype TEXT NOT NULL,
+            state TEXT, updatedtime TEXT, viewtracker TEXT)''')
+    cur.execute('''CREATE TABLE comments(
+            id INTEGER PRIMARY KEY, cttissue TEXT NOT NULL, date TEXT NOT NULL,
+            updatedby TEXT NOT NULL, comment TEXT NOT NULL)''')
+    cur.execute('''CREATE TABLE history(
+            id INTEGER PRIMARY KEY, cttissue TEXT NOT NULL, date TEXT NOT NULL,
+            updatedby TEXT NOT NULL, info TEXT)''')
+    cur.execute('''CREATE TABLE siblings(
+            id INTEGER PRIMARY KEY, cttissue TEXT NOT NULL, date TEXT NOT NULL, status TEXT NOT NULL,
+            parent TEXT NOT NULL, sibling TEXT NOT NULL, state TEXT)''')
+
+
+def stamp(minute):	#minutes after 2018-01-01 as an ISO8601 timestamp, like datetime.isoformat() in ctt
+    return (start + datetime.timedelta(minutes=minute, microseconds=minute * 7919 % 1000000)).isoformat()
+
+
+def hostname(rng, racks):
+    return 'r%di%dn%d' % (rng.randint(1, racks), rng.randint(0, 7), rng.randint(0, 35))
+
+
+def siblings_of(node):	#same layout as cttlib.resolve_siblings() with 4 nodes per blade
+    rack, rest = node[1:].split('i')
+    iru, slot = rest.split('n')
+    return ['r%si%sn%d' % (rack, iru, int(slot) % 9 + i * 9) for i in range(4)]
+
+
+def generate(path, issues=100000, history=20, comments=10, open_issues=500, sibling_issues=1000, racks=40, seed=1):
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.unlink(path)
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    cur.execute('PRAGMA journal_mode = OFF')
+    cur.execute('PRAGMA synchronous = OFF')
+    create_schema(cur)
+    cur.execute('''INSERT INTO issues(cttissue,date,severity,ticket,status,cluster,hostname,issuetitle,
+            issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,viewtracker)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (1000, stamp(0), 99, '---', '---', '---', '---', '---', 'Created table', '---', '---', '---', '---', '---', '---', '---'))
+
+    open_issues = min(open_issues, issues)	#--issues 100 with the --open and --sibling-issues defaults
+    sibling_issues = min(sibling_issues, issues)
+    span = 5 * 365 * 1440	#five years of minutes
+    openset = set(rng.sample(range(issues), open_issues))
+    sibset = set(rng.sample(range(issues), sibling_issues)) | set(sorted(openset)[:20])	#some open ones for --close
+    issuerows = []
+    commentrows = []
+    historyrows = []
+    siblingrows = []
+    for n in range(issues):
+        cttissue = str(1001 + n)
+        opened = int(span * n / issues)
+        closed = opened + rng.randint(30, 60 * 24 * 30)
+        node = hostname(rng, racks)
+        part = rng.choice(parts)
+        title = '%s %s' % (rng.choice(problems), part)
+        originator = 'ctt' if rng.random() < 0.6 else rng.choice(users[:-1])
+        status = 'open' if n in openset else ('deleted' if rng.random() < 0.01 else 'closed')
+        tickets = '---'
+        if rng.random() < 0.3:
+            tickets = ','.join('HPE%d' % (rng.randint(10000000, 99999999)) for i in range(rng.randint(1, 2)))
+        unseen = [group for group in groups if rng.random() < 0.3]
+        updated = opened if status == 'open' else closed
+        issuerows.append((cttissue, stamp(opened), rng.randint(1, 4), tickets, status, rng.choice(['casper', 'cheyenne']),
+                          node, title, '%s, seen by %s. Please open a vendor ticket.' % (title, originator),
+                          rng.choice(groups + ['ctt']), originator, rng.choice(users), rng.choice('hhhsuo'),
+                          rng.choice(states), stamp(updated), '.'.join(unseen) or '---'))
+
+        when = opened
+        historyrows.append((cttissue, stamp(when), originator, 'new issue'))
+        for i in range(history - 2):
+            when += rng.randint(1, 600)
+            if rng.random() < 0.5:
+                historyrows.append((cttissue, stamp(when), 'ctt', '%s state changed to %s' % (node, rng.choice(states))))
+            elif rng.random() < 0.1:
+                historyrows.append((cttissue, stamp(when), rng.choice(users), 'reopened issue: still failing %s' % (part)))
+            else:
+                historyrows.append((cttissue, stamp(when), rng.choice(users), 'updated issue severity to: %d' % (rng.randint(1, 4))))
+        if status != 'open':
+            historyrows.append((cttissue, stamp(closed), rng.choice(users), 'closed issue: replaced %s' % (part)))
+        for i in range(comments):
+            commentrows.append((cttissue, stamp(opened + i * 37), rng.choice(users),
+                                '%s %s, reseated and ran diags, %d errors.' % (rng.choice(problems), part, rng.randint(0, 500))))
+        if n in sibset:
+            for sib in siblings_of(node):
+                if sib != node:
+                    siblingrows.append((cttissue, stamp(opened), 'open' if status == 'open' else 'closed', node, sib, rng.choice(states)))
+
+        if len(historyrows) > 200000:
+            flush(cur, issuerows, commentrows, historyrows, siblingrows)
+    flush(cur, issuerows, commentrows, historyrows, siblingrows)
+    con.commit()
+    con.close()
+
+
+def flush(cur, issuerows, commentrows, historyrows, siblingrows):
+    cur.executemany('''INSERT INTO issues(cttissue,date,severity,ticket,status,cluster,hostname,issuetitle,
+            issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,viewtracker)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', issuerows)
+    cur.executemany('''INSERT INTO comments(cttissue,date,updatedby,comment) VALUES(?, ?, ?, ?)''', commentrows)
+    cur.executemany('''INSERT INTO history(cttissue,date,updatedby,info) VALUES(?, ?, ?, ?)''', historyrows)
+    cur.executemany('''INSERT INTO siblings(cttissue,date,status,parent,sibling,state) VALUES(?, ?, ?, ?, ?, ?)''', siblingrows)
+    for rows in (issuerows, commentrows, historyrows, siblingrows):
+        del rows[:]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic ctt.sqlite')
+    parser.add_argument('path')
+    parser.add_argument('--issues', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=20, help='history rows per issue')
+    parser.add_argument('--comments', type=int, default=10, help='comments per issue')
+    parser.add_argument('--open', type=int, default=500, help='open issues')
+    parser.add_argument('--sibling-issues', type=int, default=1000, help='issues with attached siblings')
+    parser.add_argument('--racks', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, args.issues, args.history, args.comments, args.open, args.sibling_issues, args.racks, args.seed)
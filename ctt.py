@@ -33,9 +33,9 @@ from cttlib import *
 import datetime
 import argparse
 import sys
-from configparser import ConfigParser
 import os
 import getpass
+import atexit
 from syslog import syslog
 
 #syslog argv
@@ -43,7 +43,7 @@ logme = ' '.join(sys.argv)
 syslog(logme)
 
 check_nolocal()
-con = SQL.connect('ctt.sqlite')
+atexit.register(session_end)	#one transaction per ctt command, committed at exit
 date = datetime.datetime.now().isoformat() #ISO8601
 user = os.environ.get("SUDO_USER")
 if user is None:
@@ -52,9 +52,6 @@ updatedby = user
 UserGroup = GetUserGroup(usersdict, user)
 groupsList = GetGroups(usersdict, user)
 checkdb(date)
-config = ConfigParser()
-config.read('ctt.ini')
-defaults = config['DEFAULTS']
 severity = defaults['severity']
 issuestatus = defaults['issuestatus']
 issuetype = defaults['issuetype']
@@ -70,313 +67,389 @@ try: #??????
 except IndexError:  #??????                                                                                                                                                                                         
     show_help()
 
-if '--auto' in sys.argv[1]:
-    run_auto(date,severity,assignedto,updatedby,cluster,UserGroup)   
-    exit(0)  
-
-elif '--attach' in sys.argv[1]:
-    # ./ctt.py --attach 1020 /tmp/ipmi_sdr_list.out
-    import ntpath
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--attach', action='store', dest='attachment', nargs=2, required=True)    
-    args = parser.parse_args()
-
-    if args.attachment[0] and args.attachment[1]:  
-        create_attachment(args.attachment[0],args.attachment[1],attach_location,date,updatedby)
-        update_issue(args.attachment[0], 'updatedby', updatedby)
-        update_issue(args.attachment[0], 'updatedtime', date) 
-        filename = ntpath.basename(args.attachment[1])     
-        log_history(args.attachment[0], date, updatedby, 'Attached file: %s/%s/%s.%s' % (attach_location, args.attachment[0], date[0:16], filename))
-        comment_issue(args.attachment[0], date, updatedby, 'Attached file: %s/%s/%s.%s' % (attach_location, args.attachment[0], date[0:16], filename), UserGroup)
-        view_tracker_update(args.attachment[0],UserGroup)    
-    exit(0)
-
-elif '--list' in sys.argv[1]:
-    # ./ctt.py --list           # Shows all open
-    # ./ctt.py --list -s closed	# Options: open, closed, deleted
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--list', action='store_true', dest='listvalue', default=True, required=True)
-    parser.add_argument('-s', action='store', dest='statusvalue', choices=('open', 'closed', 'deleted', 'all'), required=False)
-    parser.add_argument('-v', action='store_true', dest='verbosevalue', default=False, required=False)
-    parser.add_argument('-vv', action='store_true', dest='vverbosevalue', default=False, required=False)
-    args = parser.parse_args()
-    
-    if not args.statusvalue:
-        args.statusvalue = 'open'
-    if args.verbosevalue is True:
-        get_issues_v(args.statusvalue)
+
+def run_command(argv):	#one ctt command, argv without the program name
+    cmd = argv[0]
+    if '--auto' in cmd:
+        run_auto(date,severity,assignedto,updatedby,cluster,UserGroup)   
+        exit(0)  
+
+    elif '--daemon' in cmd:
+        # ./ctt.py --daemon	# --auto every daemon_interval seconds until SIGTERM, SIGHUP rereads ctt.ini
+        run_daemon(severity,assignedto,updatedby,cluster,UserGroup)
         exit(0)
-    if args.vverbosevalue is True:
-        get_issues_vv(args.statusvalue)
+
+    elif '--attach' in cmd:
+        # ./ctt.py --attach 1020 /tmp/ipmi_sdr_list.out
+        import ntpath
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--attach', action='store', dest='attachment', nargs=2, required=True)    
+        args = parser.parse_args(argv)
+
+        if args.attachment[0] and args.attachment[1]:  
+            create_attachment(args.attachment[0],args.attachment[1],attach_location,date,updatedby)
+            update_issue(args.attachment[0], 'updatedby', updatedby)
+            update_issue(args.attachment[0], 'updatedtime', date) 
+            filename = ntpath.basename(args.attachment[1])     
+            log_history(args.attachment[0], date, updatedby, 'Attached file: %s/%s/%s.%s' % (attach_location, args.attachment[0], date[0:16], filename))
+            comment_issue(args.attachment[0], date, updatedby, 'Attached file: %s/%s/%s.%s' % (attach_location, args.attachment[0], date[0:16], filename), UserGroup)
+            view_tracker_update(args.attachment[0],UserGroup)    
         exit(0)
-    else:
-        get_issues(args.statusvalue)
-        exit(0) 
-
-elif '--show' in sys.argv[1]:   #We want to see deleted issues as well!!!, FIX
-    # ./ctt.py --show 1045
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--show', action='store', dest='issuenumber', nargs=1, required=True)    
-    parser.add_argument('-d', action='store_true', default=False)
-    args = parser.parse_args()
-
-    if args.issuenumber[0]:
-        get_issue_full(args.issuenumber[0])
-
-    if args.d is True:
-        get_history(args.issuenumber[0])
-
-    view_tracker_update(args.issuenumber[0],UserGroup)
-
-elif '--update' in sys.argv[1]:
-    # ./ctt.py --update 1039 -s 1 -c cheyenne -n r1i1n1 -t 689725 -a casg
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--update', action='store', dest='issuenumber', nargs=1, required=True)    
-    parser.add_argument('-s','--severity', action='store', dest='severityvalue', choices=('1','2','3','4'), required=False)
-    parser.add_argument('-c','--cluster', action='store', dest='clustervalue', required=False)
-    parser.add_argument('-n','--node', action='store', dest='nodevalue', required=False)
-    parser.add_argument('-t','--ticket', action='store', dest='ticketvalue', required=False)
-    parser.add_argument('-a','--assign', action='store', dest='assignedtovalue', required=False)
-    parser.add_argument('-i','--issuetitle', action='store', dest='issuetitlevalue', required=False)
-    parser.add_argument('-d','--description', action='store', dest='descvalue', required=False)    
-    parser.add_argument('-x', '--type', action='store', dest='typevalue', choices=('h','h!', 's', 't', 'u', 'o'), required=False)
-    args = parser.parse_args()
-
-    issue_list = args.issuenumber[0].split(',')
-    for cttissue in issue_list:
 
-        if args.typevalue:
-            try:
-                if cttissue:
-                    if args.typevalue == 'h!':
-                        #print(cttissue)
-                        add_siblings(cttissue,date,updatedby)
-                        args.typevalue = 'h'
-                    update_issue(cttissue, 'issuetype', args.typevalue)	# 1009 issuetype {hardware,software,test,unknown,other}
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated issue type to: %s' % (args.typevalue))
-            except IndexError:
-                parser.print_help()
+    elif '--list' in cmd:
+        # ./ctt.py --list           # Shows all open
+        # ./ctt.py --list -s closed	# Options: open, closed, deleted
+        # ./ctt.py --list -s all --since 2021-01-01 --until 2021-02-01 -c casper --limit 50
+        # ./ctt.py --list -s all --limit 50 --after 1050	# next 50 issues after issue 1050
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--list', action='store_true', dest='listvalue', default=True, required=True)
+        parser.add_argument('-s', action='store', dest='statusvalue', choices=('open', 'closed', 'deleted', 'all'), required=False)
+        parser.add_argument('-v', action='store_true', dest='verbosevalue', default=False, required=False)
+        parser.add_argument('-vv', action='store_true', dest='vverbosevalue', default=False, required=False)
+        parser.add_argument('--limit', action='store', dest='limitvalue', type=int, required=False)
+        parser.add_argument('--after', action='store', dest='aftervalue', required=False)
+        parser.add_argument('--since', action='store', dest='sincevalue', required=False)
+        parser.add_argument('--until', action='store', dest='untilvalue', required=False)
+        parser.add_argument('-c','--cluster', action='store', dest='clustervalue', required=False)
+        parser.add_argument('-a','--assign', action='store', dest='assignedtovalue', required=False)
+        parser.add_argument('--severity', action='store', dest='severityvalue', choices=('1','2','3','4'), required=False)
+        parser.add_argument('-x', '--type', action='store', dest='typevalue', choices=('h', 's', 't', 'u', 'o'), required=False)
+        parser.add_argument('--unseen', action='store_true', dest='unseenvalue', default=False, required=False)
+        add_output_args(parser)	#--json, --csv, --ndjson
+        args = parser.parse_args(argv)
+
+        if not args.statusvalue:
+            args.statusvalue = 'open'
+        check_date(args.sincevalue)
+        check_date(args.untilvalue)
+        if args.aftervalue and issue_exists_check(args.aftervalue) is False:
+            print("Issue %s not found" % (args.aftervalue))
+            exit(1)
+        if args.limitvalue is not None and args.limitvalue < 1:
+            print('--limit must be 1 or more')
+            exit(1)
+        filters = {'limit': args.limitvalue, 'after': args.aftervalue, 'since': args.sincevalue, 'until': args.untilvalue, \
+                   'cluster': args.clustervalue, 'assignedto': args.assignedtovalue, 'severity': args.severityvalue, \
+                   'issuetype': args.typevalue, 'unseen': UserGroup if args.unseenvalue else None}
+        if args.outformat:
+            list_records(args.statusvalue, filters, args.outformat)
+            exit(0)
+        if args.verbosevalue is True:
+            get_issues_v(args.statusvalue, filters)
+            exit(0)
+        if args.vverbosevalue is True:
+            get_issues_vv(args.statusvalue, filters)
+            exit(0)
+        else:
+            get_issues(args.statusvalue, filters)
+            exit(0) 
+
+    elif '--search' in cmd:
+        # ./ctt.py --search P2-DIMM1G	# issue titles and descriptions first, then comments, then history
+        # ./ctt.py --search ECC dimm* -s open --since 2021-01-01
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--search', action='store', dest='searchvalue', nargs='+', required=True)
+        parser.add_argument('-s', action='store', dest='statusvalue', choices=('open', 'closed', 'deleted', 'all'), default='all', required=False)
+        parser.add_argument('--since', action='store', dest='sincevalue', required=False)
+        parser.add_argument('--limit', action='store', dest='limitvalue', type=int, default=50, required=False)
+        add_output_args(parser)	#--json, --csv, --ndjson
+        args = parser.parse_args(argv)
+
+        check_date(args.sincevalue)
+        get_search(args.searchvalue, args.statusvalue, args.sincevalue, args.limitvalue, args.outformat)
+        exit(0)
+
+    elif '--ticket' in cmd:
+        # ./ctt.py --ticket HPE48207411	# which issues an external ticket is on
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--ticket', action='store', dest='ticketvalue', required=True)
+        parser.add_argument('-s', action='store', dest='statusvalue', choices=('open', 'closed', 'deleted', 'all'), default='all', required=False)
+        add_output_args(parser)	#--json, --csv, --ndjson
+        args = parser.parse_args(argv)
+
+        filters = {'ticket': args.ticketvalue}
+        if args.outformat:
+            list_records(args.statusvalue, filters, args.outformat)
+        else:
+            get_issues_v(args.statusvalue, filters)
+        exit(0)
+
+    elif '--show' in cmd:   #We want to see deleted issues as well!!!, FIX
+        # ./ctt.py --show 1045
+        # ./ctt.py --show 1045 --json	# comments, history and siblings included
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--show', action='store', dest='issuenumber', nargs=1, required=True)    
+        parser.add_argument('-d', action='store_true', default=False)
+        add_output_args(parser)	#--json, --csv, --ndjson
+        args = parser.parse_args(argv)
+
+        if args.outformat:
+            show_records(args.issuenumber[0], args.outformat)
+        elif args.issuenumber[0]:
+            get_issue_full(args.issuenumber[0])
+
+        if args.d is True and not args.outformat:
+            get_history(args.issuenumber[0])
+
+        view_tracker_update(args.issuenumber[0],UserGroup)
+
+    elif '--update' in cmd:
+        # ./ctt.py --update 1039 -s 1 -c cheyenne -n r1i1n1 -t 689725 -a casg
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--update', action='store', dest='issuenumber', nargs=1, required=True)    
+        parser.add_argument('-s','--severity', action='store', dest='severityvalue', choices=('1','2','3','4'), required=False)
+        parser.add_argument('-c','--cluster', action='store', dest='clustervalue', required=False)
+        parser.add_argument('-n','--node', action='store', dest='nodevalue', required=False)
+        parser.add_argument('-t','--ticket', action='store', dest='ticketvalue', required=False)
+        parser.add_argument('-a','--assign', action='store', dest='assignedtovalue', required=False)
+        parser.add_argument('-i','--issuetitle', action='store', dest='issuetitlevalue', required=False)
+        parser.add_argument('-d','--description', action='store', dest='descvalue', required=False)    
+        parser.add_argument('-x', '--type', action='store', dest='typevalue', choices=('h','h!', 's', 't', 'u', 'o'), required=False)
+        args = parser.parse_args(argv)
 
         if args.issuetitlevalue:
             test_arg_size(args.issuetitlevalue,what='issue title',maxchars=100)
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'issuetitle', args.issuetitlevalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated issue title to: %s' % (args.issuetitlevalue))
-            except IndexError:
-                parser.print_help()
-
         if args.descvalue:
             test_arg_size(args.descvalue,what='issue description',maxchars=4000)
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'issuedescription', args.descvalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated issue description to: %s' % (args.descvalue))
-            except IndexError:
-                parser.print_help()
+        if args.assignedtovalue != None and args.assignedtovalue not in groupsList:
+            print("Assign to group \"%s\" is not a valid users group, Exiting!" % (args.assignedtovalue))
+            args.assignedtovalue = None
 
+        #every field for every issue in one pass, the history rows in the order ctt has always logged them
+        changes = []
+        siblings = False
+        if args.typevalue:
+            if args.typevalue == 'h!':
+                siblings = True
+                args.typevalue = 'h'
+            changes.append(('issuetype', args.typevalue, 'updated issue type to: %s' % (args.typevalue)))	# 1009 issuetype {hardware,software,test,unknown,other}
+        if args.issuetitlevalue:
+            changes.append(('issuetitle', args.issuetitlevalue, 'updated issue title to: %s' % (args.issuetitlevalue)))
+        if args.descvalue:
+            changes.append(('issuedescription', args.descvalue, 'updated issue description to: %s' % (args.descvalue)))
         if args.severityvalue:
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'severity', args.severityvalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated issue severity to: %s' % (args.severityvalue))
-            except IndexError:
-                parser.print_help()
-
+            changes.append(('severity', args.severityvalue, 'updated issue severity to: %s' % (args.severityvalue)))
         if args.clustervalue:
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'cluster', args.clustervalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated cluster to: %s' % (args.clustervalue))
-            except IndexError:
-                parser.print_help()
-
+            changes.append(('cluster', args.clustervalue, 'updated cluster to: %s' % (args.clustervalue)))
         if args.nodevalue:
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'node', args.nodevalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'updated node to: %s' % (args.nodevalue))
-            except IndexError:
-                parser.print_help()
-
-        if args.assignedtovalue in groupsList:
-            try:
-                if cttissue:
-                    update_issue(cttissue, 'assignedto', args.assignedtovalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'assigned issue to: %s' % (args.assignedtovalue))
-            except IndexError:
-                parser.print_help()
-        elif args.assignedtovalue != None:
-            print("Assign to group \"%s\" is not a valid users group, Exiting!" % (args.assignedtovalue))
-
+            changes.append(('hostname', args.nodevalue, 'updated node to: %s' % (args.nodevalue)))
+        if args.assignedtovalue:
+            changes.append(('assignedto', args.assignedtovalue, 'assigned issue to: %s' % (args.assignedtovalue)))
         if args.ticketvalue:
+            changes.append((None, args.ticketvalue, 'toggled ticket: %s' % (args.ticketvalue)))
+
+        if changes:
+            update_issues(args.issuenumber[0].split(','), changes, date, updatedby, UserGroup, siblings)
+
+    elif '--comment' in cmd: 
+        # ./ctt.py --comment 12390,12011 "Need an update"
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--comment', action='store', dest='comment', nargs=2, required=True)    
+        args = parser.parse_args(argv)
+
+        if args.comment[0] and args.comment[1]:
+            issue_list = args.comment[0].split(',')
+            for cttissue in issue_list: 
+                test_arg_size(args.comment[1],what='comment',maxchars=500)
+                comment_issue(cttissue, date, updatedby, args.comment[1],UserGroup)
+                update_issue(cttissue, 'updatedby', updatedby)
+                update_issue(cttissue, 'updatedtime', date)
+                log_history(cttissue, date, updatedby, 'commented issue with: %s' % (args.comment[1]))
+
+    elif '--delete' in cmd:	#make where must be 'admin' to delete 
+        # ./ctt.py --delete 10101 "Duplicate issue"
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--delete', action='store', dest='deletevalue', nargs=2, required=True) #NEED TO FIX DELETE   
+        args = parser.parse_args(argv)
+
+        if args.deletevalue[0] and args.deletevalue[1]:
+            test_arg_size(args.deletevalue[1],what='comment',maxchars=500)
+            comment_issue(args.deletevalue[0], date, updatedby, args.deletevalue[1],UserGroup)
+            delete_issue(args.deletevalue[0])
+            update_issue(args.deletevalue[0], 'updatedby', updatedby)
+            update_issue(args.deletevalue[0], 'updatedtime', date)
+            log_history(args.deletevalue[0],date,updatedby,'deleted issue: %s' % (args.deletevalue[1]))
+
+    elif '--close' in cmd:
+        # ./ctt.py --close 1028,1044 "Issue resolved"
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--close', action='store', dest='closevalue', nargs=2, required=True)    
+        args = parser.parse_args(argv)
+
+        if args.closevalue[0] and args.closevalue[1]:
+            issue_list = args.closevalue[0].split(',')
+            for cttissue in issue_list:
+                test_arg_size(args.closevalue[1],what='comment',maxchars=500)
+                comment_issue(cttissue, date, updatedby, args.closevalue[1],UserGroup)
+                update_issue(cttissue, 'updatedby', updatedby)
+                update_issue(cttissue, 'updatedtime', date)
+                close_issue(cttissue, date, updatedby)
+                log_history(cttissue, date, updatedby, 'closed issue: %s' % (args.closevalue[1]))
+
+    elif '--reopen' in cmd:
+        # ./ctt.py --reopen 10282,10122 "Accidental close"
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--reopen', action='store', dest='reopenvalue', nargs=2, required=True)    
+        args = parser.parse_args(argv)
+
+        if args.reopenvalue[0] and args.reopenvalue[1]:
+            issue_list = args.reopenvalue[0].split(',')
+            for cttissue in issue_list:
+                test_arg_size(args.reopenvalue[1],what='comment',maxchars=500)
+                comment_issue(cttissue, date, updatedby, args.reopenvalue[1],UserGroup)
+                update_issue(cttissue, 'updatedby', updatedby)
+                update_issue(cttissue, 'updatedtime', date)
+                update_issue(cttissue, 'status', 'open')
+                log_history(cttissue, date, updatedby, 'reopened issue: %s' % (args.reopenvalue[1]))
+                if pbs_enforcement == 'False':
+                    print("pbs_enforcement is False. Not draining nodes")
+                else:
+                    pbs_drain(cttissue,date,updatedby,get_hostname(cttissue))
+
+    elif '--open' in cmd:
+        # ./ctt.py --open "Failed dimm on r1i1n1" "Description here" -c cheyenne -s 1 -n r1i1n1,r1i1n10 -a casg
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--open', action='store', dest='openvalue', nargs='+', required=True)
+        parser.add_argument('-s','--severity', action='store', dest='severityvalue', required=False)
+        parser.add_argument('-c','--cluster', action='store', dest='clustervalue', required=False)
+        parser.add_argument('-n','--node', action='store', dest='nodevalue', required=True)
+        parser.add_argument('-a','--assign', action='store', dest='assignedtovalue', required=False)
+        parser.add_argument('-t', '--ticket', action='store', dest='ticketvalue', required=False)
+        parser.add_argument('-x', '--type', action='store', dest='typevalue', choices=('h', 's', 't', 'u', 'o'), required=False)    
+        args = parser.parse_args(argv)
+
+
+        try:
+            node_list = expand_nodeset(args.nodevalue)
+        except ValueError:
+            print("Can not expand node set %s, Exiting!" % (args.nodevalue))
+            exit(1)
+        if strict_node_match.strip() != 'False':	#ctt.ini values are strings
             try:
-                if cttissue:
-                    update_ticket(cttissue, args.ticketvalue)
-                    update_issue(cttissue, 'updatedby', updatedby)
-                    update_issue(cttissue, 'updatedtime', date)
-                    view_tracker_new(cttissue,UserGroup,viewnotices)
-                    log_history(cttissue,date,updatedby,'toggled ticket: %s' % (args.ticketvalue))
-            except IndexError:
-                parser.print_help()
-
-elif '--comment' in sys.argv[1]: 
-    # ./ctt.py --comment 12390,12011 "Need an update"
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--comment', action='store', dest='comment', nargs=2, required=True)    
-    args = parser.parse_args()
-
-    if args.comment[0] and args.comment[1]:
-        issue_list = args.comment[0].split(',')
-        for cttissue in issue_list: 
-            test_arg_size(args.comment[1],what='comment',maxchars=500)
-            comment_issue(cttissue, date, updatedby, args.comment[1],UserGroup)
-            update_issue(cttissue, 'updatedby', updatedby)
-            update_issue(cttissue, 'updatedtime', date)
-            log_history(cttissue, date, updatedby, 'commented issue with: %s' % (args.comment[1]))
-
-elif '--delete' in sys.argv[1]:	#make where must be 'admin' to delete 
-    # ./ctt.py --delete 10101 "Duplicate issue"
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--delete', action='store', dest='deletevalue', nargs=2, required=True) #NEED TO FIX DELETE   
-    args = parser.parse_args()
-
-    if args.deletevalue[0] and args.deletevalue[1]:
-        test_arg_size(args.deletevalue[1],what='comment',maxchars=500)
-        comment_issue(args.deletevalue[0], date, updatedby, args.deletevalue[1],UserGroup)
-        delete_issue(args.deletevalue[0])
-        update_issue(args.deletevalue[0], 'updatedby', updatedby)
-        update_issue(args.deletevalue[0], 'updatedtime', date)
-        log_history(args.deletevalue[0],date,updatedby,'deleted issue: %s' % (args.deletevalue[1]))
-
-elif '--close' in sys.argv[1]:
-    # ./ctt.py --close 1028,1044 "Issue resolved"
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--close', action='store', dest='closevalue', nargs=2, required=True)    
-    args = parser.parse_args()
-
-    if args.closevalue[0] and args.closevalue[1]:
-        issue_list = args.closevalue[0].split(',')
-        for cttissue in issue_list:
-            test_arg_size(args.closevalue[1],what='comment',maxchars=500)
-            comment_issue(cttissue, date, updatedby, args.closevalue[1],UserGroup)
-            update_issue(cttissue, 'updatedby', updatedby)
-            update_issue(cttissue, 'updatedtime', date)
-            close_issue(cttissue, date, updatedby)
-            log_history(cttissue, date, updatedby, 'closed issue: %s' % (args.closevalue[1]))
-
-elif '--reopen' in sys.argv[1]:
-    # ./ctt.py --reopen 10282,10122 "Accidental close"
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--reopen', action='store', dest='reopenvalue', nargs=2, required=True)    
-    args = parser.parse_args()
-
-    if args.reopenvalue[0] and args.reopenvalue[1]:
-        issue_list = args.reopenvalue[0].split(',')
-        for cttissue in issue_list:
-            test_arg_size(args.reopenvalue[1],what='comment',maxchars=500)
-            comment_issue(cttissue, date, updatedby, args.reopenvalue[1],UserGroup)
-            update_issue(cttissue, 'updatedby', updatedby)
-            update_issue(cttissue, 'updatedtime', date)
-            update_issue(cttissue, 'status', 'open')
-            log_history(cttissue, date, updatedby, 'reopened issue: %s' % (args.reopenvalue[1]))
-            if pbs_enforcement == 'False':
-                print("pbs_enforcement is False. Not draining nodes")
-            else:
-                pbs_drain(cttissue,date,updatedby,get_hostname(cttissue))
-
-elif '--open' in sys.argv[1]:
-    # ./ctt.py --open "Failed dimm on r1i1n1" "Description here" -c cheyenne -s 1 -n r1i1n1,r1i1n10 -a casg
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--open', action='store', dest='openvalue', nargs='+', required=True)
-    parser.add_argument('-s','--severity', action='store', dest='severityvalue', required=False)
-    parser.add_argument('-c','--cluster', action='store', dest='clustervalue', required=False)
-    parser.add_argument('-n','--node', action='store', dest='nodevalue', required=True)
-    parser.add_argument('-a','--assign', action='store', dest='assignedtovalue', required=False)
-    parser.add_argument('-t', '--ticket', action='store', dest='ticketvalue', required=False)
-    parser.add_argument('-x', '--type', action='store', dest='typevalue', choices=('h', 's', 't', 'u', 'o'), required=False)    
-    args = parser.parse_args()
-
-
-    if strict_node_match is not False:
-        if not (args.nodevalue in strict_node_match):
-            print("Can not find %s in strict_node_match, Exiting!" % (args.nodevalue))
-            exit()
-
-    if args.assignedtovalue:
-        assignedto = args.assignedtovalue
-    if not args.ticketvalue:      
-        args.ticketvalue = '---'
-    if not args.typevalue:
-        args.typevalue = issuetype
-    if not args.severityvalue:
-        args.severityvalue = severity 
-    if not args.clustervalue:
-        args.clustervalue = cluster
-
-    if args.openvalue[0] and args.openvalue[1]:
-        print(args.nodevalue)
-        node_list = args.nodevalue.split(',')
-        for node in node_list: 
+                allowed = expand_nodeset(strict_node_match)
+            except ValueError:
+                print("Can not expand strict_node_match %s in ctt.ini, Exiting!" % (strict_node_match))
+                exit(1)
+            missing = [node for node in node_list if node not in allowed]
+            if missing:
+                print("Can not find %s in strict_node_match, Exiting!" % (','.join(missing)))
+                exit(1)
+
+        openassignedto = assignedto
+        if args.assignedtovalue:
+            openassignedto = args.assignedtovalue
+        if not args.ticketvalue:      
+            args.ticketvalue = '---'
+        if not args.typevalue:
+            args.typevalue = issuetype
+        if not args.severityvalue:
+            args.severityvalue = severity 
+        if not args.clustervalue:
+            args.clustervalue = cluster
+
+        if args.openvalue[0] and args.openvalue[1]:
+            print(args.nodevalue)
             test_arg_size(args.openvalue[0],what='issue title',maxchars=100)
             test_arg_size(args.openvalue[1],what='issue description',maxchars=4000)
-            cttissue = new_issue(date, args.severityvalue, args.ticketvalue, 'open', \
-                                 args.clustervalue, node, args.openvalue[0], \
-                                 args.openvalue[1], assignedto, updatedby, \
-                                 updatedby, args.typevalue, 'unknown', date,UserGroup) 
-            log_history(cttissue, date, updatedby, 'new issue')
-
-elif '--help' in sys.argv[1] or '-h' in sys.argv[1]:
-    show_help()
-
-elif '--stats' in sys.argv[1]:
-    from cttstats import *
-
-    # ./ctt.py --stats -n casper15  # ./ctt.py --stats -c
-    parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
-    parser.add_argument('--stats', action='store_true', required=True) 
-    parser.add_argument('-n','--node', action='store', dest='nodevalue', required=False)
-    parser.add_argument('-c','--counts', action='store_true', dest='countsvalue', required=False)
-    args = parser.parse_args()
-
-    if args.countsvalue:
-        run_stats_counts()
+            cttissues = new_issues(date, args.severityvalue, args.ticketvalue, 'open', \
+                                   args.clustervalue, node_list, args.openvalue[0], \
+                                   args.openvalue[1], openassignedto, updatedby, \
+                                   updatedby, args.typevalue, 'unknown', date,UserGroup)
+            log_histories([(cttissue, date, updatedby, 'new issue') for cttissue in cttissues])
+
+    elif '--batch' in cmd:
+        # ./ctt.py --batch ops.txt	# one ctt command per line, e.g. --close 1028 "Issue resolved"
+        # ./ctt.py --batch - < ops.json	# or a JSON list of argv lists
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--batch', action='store', dest='batchvalue', required=True)
+        args = parser.parse_args(argv)
+
+        run_batch(args.batchvalue)
         exit(0)
-    
-    if args.nodevalue:
-        run_stats_node(args.nodevalue)
-        exit(0)
-
-
-
-
-
-
 
+    elif '--help' in cmd or '-h' in cmd:
+        show_help()
 
+    elif '--stats' in cmd:
+        from cttstats import breakdowns, run_stats_node, run_stats_counts, run_stats_rebuild, run_stats_mttr, run_stats_reliability
+
+        # ./ctt.py --stats -n casper15  # ./ctt.py --stats -c
+        # ./ctt.py --stats -c --since 2021-01-01 --until 2022-01-01 --by cluster --by month
+        parser = argparse.ArgumentParser(add_help=False, description="Cluster Ticket Tracker Version 1.0.0")
+        parser.add_argument('--stats', action='store_true', required=True) 
+        parser.add_argument('-n','--node', action='store', dest='nodevalue', required=False)
+        parser.add_argument('-c','--counts', action='store_true', dest='countsvalue', required=False)
+        parser.add_argument('--since', action='store', dest='sincevalue', required=False)
+        parser.add_argument('--until', action='store', dest='untilvalue', required=False)
+        parser.add_argument('--by', action='append', dest='byvalue', choices=sorted(breakdowns), required=False)
+        parser.add_argument('--rebuild', action='store_true', dest='rebuildvalue', required=False)
+        parser.add_argument('--mttr', action='store_true', dest='mttrvalue', required=False)
+        parser.add_argument('--reliability', action='store_true', dest='reliabilityvalue', required=False)
+        parser.add_argument('--top', action='store', dest='topvalue', type=int, default=10, required=False)
+        add_output_args(parser)	#--json, --csv, --ndjson
+        args = parser.parse_args(argv)
+
+        if args.rebuildvalue:
+            run_stats_rebuild()
+            exit(0)
+
+        if args.mttrvalue or args.reliabilityvalue:
+            check_date(args.sincevalue)
+            check_date(args.untilvalue)
+            if args.mttrvalue:
+                run_stats_mttr(args.outformat, args.sincevalue, args.untilvalue)
+            if args.reliabilityvalue:
+                run_stats_reliability(args.outformat, args.sincevalue, args.untilvalue, args.topvalue)
+            exit(0)
+
+        if args.countsvalue:
+            check_date(args.sincevalue)
+            check_date(args.untilvalue)
+            run_stats_counts(args.outformat, args.sincevalue, args.untilvalue, args.byvalue)
+            exit(0)
 
+        if args.nodevalue:
+            run_stats_node(args.nodevalue, args.outformat)
+            exit(0)
+    else:
+        show_help()
 
-else:
-    show_help()
 
+batch_commands = ('--open', '--update', '--comment', '--close', '--reopen', '--delete', '--attach', \
+                  '--list', '--show', '--search', '--ticket', '--stats')
+
+def run_batch(source):	#ctt --batch, every operation in one process and one transaction
+    ops = read_batch(source)
+    batch_begin()
+    pbs_defer()	#drains and resumes are merged and run after the commit
+    failed = []
+    for n, argv in ops:
+        if argv[0] not in batch_commands:
+            print("[%s] skipped: %s can not run in a batch" % (n, argv[0]))
+            failed.append(n)
+            continue
+        syslog('ctt --batch: %s' % (' '.join(argv)))
+        batch_savepoint()
+        try:
+            run_command(argv)
+            status = 0
+        except SystemExit as e:	#exit() or exit(0) is success, errors exit 1, argparse errors exit 2
+            status = e.code or 0
+        except Exception as e:
+            print(e)
+            status = 1
+        batch_release(status == 0)
+        if status == 0:
+            print("[%s] ok: %s" % (n, ' '.join(argv)))
+        else:
+            print("[%s] failed (%s): %s" % (n, status, ' '.join(argv)))
+            failed.append(n)
+    session_commit()
+    pbs_flush()
+    print("batch: %s operations, %s ok, %s failed" % (len(ops), len(ops) - len(failed), len(failed)))
+    if failed:
+        print("failed lines: %s" % (', '.join(str(n) for n in failed)))
+        exit(1)
+
+
+run_command(sys.argv[1:])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#Copyright (c) 2020, University Corporation for Atmospheric Research
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without 
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, 
+#this list of conditions and the following disclaimer.
+#
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#3. Neither the name of the copyright holder nor the names of its contributors
+#may be used to endorse or promote products derived from this software without
+#specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+#LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+#WHETHER IN CONTRACT, STRICT LIABILITY,
+#OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+import os
+import signal
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+#Runs the external commands ctt needs (clush, pbsnodes) with subprocess instead of os.popen.
+#Every command gets a timeout and comes back with its return code, stdout and stderr.
+
+CmdResult = namedtuple('CmdResult', 'cmd returncode stdout stderr timedout elapsed')
+
+
+def run_cmd(cmd, timeout):	#one shell command, killed with its whole process group after timeout seconds
+    start = time.time()
+    if timeout is not None and timeout <= 0:	#batch deadline already passed, do not start it
+        return CmdResult(cmd, None, '', '', True, 0.0)
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, \
+                            universal_newlines=True, start_new_session=True)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+        return CmdResult(cmd, proc.returncode, stdout, stderr, False, time.time() - start)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)	#clush and its ssh children, not just the shell
+        except (ProcessLookupError, PermissionError):	#the group exited on its own meanwhile
+            pass
+        stdout, stderr = proc.communicate()
+        return CmdResult(cmd, None, stdout, stderr, True, time.time() - start)
+
+
+def run_cmds(cmds, timeout, deadline=None, maxcommands=8):	#independent commands, at most maxcommands at once
+    #timeout is per command, deadline is a time.time() value for the whole batch.
+    #Results come back in the same order as cmds.
+    def run_one(cmd):
+        cmdtimeout = timeout
+        if deadline is not None:
+            cmdtimeout = min(timeout, deadline - time.time())
+        return run_cmd(cmd, cmdtimeout)
+
+    if not cmds:
+        return []
+    if len(cmds) == 1:
+        return [run_one(cmds[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(int(maxcommands), len(cmds)))) as pool:
+        return list(pool.map(run_one, cmds))
@@ -30,35 +30,147 @@
 
 import sqlite3 as SQL
 import textwrap
+import csv
+import json
 from configparser import ConfigParser 
 import os
 import socket
+import fcntl
 import sys
 import re
 import getpass
+import signal
+import time
+import datetime
+import hashlib
+import shlex
+from collections import namedtuple
+from itertools import groupby, product
+from cttexec import run_cmd, run_cmds
+
+
+def load_config():	#reads ctt.ini into the module settings, ctt --daemon calls it again on SIGHUP
+    global config, defaults, pbsadmin, users, pbsnodes_path, clush_path, maxissuesopen, maxissuesrun, \
+           pbs_enforcement, strict_node_match, strict_node_match_auto, badnode_timeout, maxcommands, \
+           daemon_interval, journal_mode, busy_timeout, auto_deadline, usersdict, viewnotices
+    config = ConfigParser()
+    config.read('ctt.ini')
+    defaults = config['DEFAULTS'] 
+    pbsadmin = defaults['pbsadmin']
+    users = config['USERS']
+    pbsnodes_path = defaults['pbsnodes_path']
+    clush_path = defaults['clush_path']
+    maxissuesopen = defaults['maxissuesopen'] #ONLY USED WITH AUTO, CAN STILL MANUALLY OPEN ISSUES
+    maxissuesrun = defaults['maxissuesrun']
+    pbs_enforcement = defaults['pbs_enforcement'] #with False, will not resume or offline nodes in pbs
+    strict_node_match = defaults['strict_node_match'] #False or comma del list of nodes
+    strict_node_match_auto = defaults['strict_node_match_auto'] #False or comma del list of nodes
+    badnode_timeout = defaults.get('badnode_timeout', '60') #seconds, deadline for reading THIS_IS_A_BAD_NODE on all new issue nodes
+    maxcommands = defaults.get('maxcommands', '8') #most clush/pbsnodes commands ctt runs at the same time
+    daemon_interval = defaults.get('daemon_interval', '60') #seconds between pbsnodes polls with --daemon
+    journal_mode = defaults.get('journal_mode', 'delete') #wal lets --list/--show read while --auto writes, only when ctt.sqlite is on a local disk
+    busy_timeout = defaults.get('busy_timeout', '30') #seconds a ctt command waits for another one's write lock
+    auto_deadline = defaults.get('auto_deadline', '240') #seconds an --auto run may take, keep it under the cron interval
+
+    #Get viewnotices list from ctt.ini
+    userslist = []
+    usersdict = dict(config.items('USERS'))
+
+    for key in usersdict:
+        userslist.append(key)
+        userslist = list(set(userslist))  #remove duplicates in list
+        viewnotices = ' '.join(userslist) #list to str
+
+load_config()
+
+
+#One sqlite connection (session) per ctt process. Helpers never commit on their own,
+#the whole command is one transaction that session_end() commits when ctt exits. The one
+#exception is a drain or resume, what came before it is committed before pbsnodes runs.
+_con = None
+
+def get_con():
+    global _con
+    if _con is None:
+        _con = SQL.connect('ctt.sqlite', timeout=float(busy_timeout))
+        _con.execute('''PRAGMA journal_mode = %s''' % (journal_mode))	#stored in ctt.sqlite, every process sees the same mode
+    return _con
+
+
+def session_commit():	#commit what the session has done so far, connection stays open
+    if _con is not None:
+        _con.commit()
+
+
+def batch_begin():	#ctt --batch, every operation runs inside one transaction
+    con = get_con()
+    if not con.in_transaction:
+        con.execute('''BEGIN IMMEDIATE''')	#the batch writes, take the lock up front
+
+
+_batch_queued = 0	#len(pbs_queue) when the current --batch operation started
+
+def batch_savepoint():	#before each --batch operation
+    global _batch_queued
+    get_con().execute('''SAVEPOINT batch_op''')
+    _batch_queued = len(pbs_queue or [])
+
+
+def batch_release(ok):	#after each --batch operation, a failed one leaves nothing behind
+    con = get_con()
+    if not ok:
+        con.execute('''ROLLBACK TO batch_op''')
+        if pbs_queue is not None:
+            del pbs_queue[_batch_queued:]	#nor any drains or resumes it queued
+    con.execute('''RELEASE batch_op''')
+
+
+def read_batch(source):	#ctt --batch FILE|-, returns [(line number, argv), ...]
+    #Either one ctt command per line ("ctt" optional, shell quoting, # comments) or a JSON
+    #list whose items are argv lists or command lines.
+    if source == '-':
+        text = sys.stdin.read()
+    else:
+        try:
+            with open(source) as f:
+                text = f.read()
+        except OSError as e:
+            print("Can not read batch file %s: %s" % (source, e.strerror))
+            exit(1)
+    if text.lstrip().startswith('['):
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            print("Batch file %s is not valid JSON: %s" % (source, e))
+            exit(1)
+        lines = [(n, item) for n, item in enumerate(items, 1)]
+    else:
+        lines = [(n, line) for n, line in enumerate(text.splitlines(), 1) if line.strip() and not line.lstrip().startswith('#')]
+    ops = []
+    for n, line in lines:
+        try:
+            argv = shlex.split(line) if isinstance(line, str) else [str(arg) for arg in line]
+        except ValueError as e:
+            print("Batch line %s: %s" % (n, e))
+            exit(1)
+        if argv and argv[0] in ('ctt', 'ctt.py', './ctt.py'):
+            argv = argv[1:]
+        if argv:
+            ops.append((n, argv))
+    return ops
+
+
+def session_end():	#registered with atexit in ctt.py
+    global _con
+    if _con is None:
+        return
+    if hasattr(sys, 'last_type'):	#ctt died on an unhandled exception, do not keep half a command
+        _con.rollback()
+    else:
+        _con.commit()	#normal end of command or exit()
+    _con.close()
+    _con = None
 
-config = ConfigParser()
-config.read('ctt.ini')                                                                                                                                                                          
-defaults = config['DEFAULTS'] 
-pbsadmin = defaults['pbsadmin']
-users = config['USERS']
-pbsnodes_path = defaults['pbsnodes_path']                                                                                                
-clush_path = defaults['clush_path']
-maxissuesopen = defaults['maxissuesopen'] #ONLY USED WITH AUTO, CAN STILL MANUALLY OPEN ISSUES
-maxissuesrun = defaults['maxissuesrun']
-pbs_enforcement = defaults['pbs_enforcement'] #with False, will not resume or offline nodes in pbs
-strict_node_match = defaults['strict_node_match'] #False or comma del list of nodes
-strict_node_match_auto = defaults['strict_node_match_auto'] #False or comma del list of nodes
-
-
-#Get viewnotices list from ctt.ini
-userslist = []
-usersdict = dict(config.items('USERS'))
-
-for key in usersdict:
-    userslist.append(key)
-    userslist = list(set(userslist))  #remove duplicates in list
-    viewnotices = ' '.join(userslist) #list to str
 
 #Get valid groups
 def GetGroups(dict, user):
@@ -83,19 +195,13 @@ def GetUserGroup(dict, user):
 
 
 def maxissueopen_issue():
-    con = SQL.connect('ctt.sqlite')
+    con = get_con()
     cur = con.cursor()
     cur.execute('''SELECT * FROM issues WHERE status = ? and issuetitle = ?''', ('open', 'MAX OPEN REACHED'))
     if cur.fetchone() == None:
         return False
 
 
-def get_open_count():
-    con = SQL.connect('ctt.sqlite')
-    cur = con.cursor()
-    cur.execute('''SELECT * FROM issues WHERE status = ?''', ('open',))
-    return len(cur.fetchall())
-
 
 def create_attachment(cttissue,filepath,attach_location,date,updatedby):
     import shutil
@@ -121,54 +227,131 @@ def create_attachment(cttissue,filepath,attach_location,date,updatedby):
         print("Error: File not attached, unknown error")
 
 
-def sibling_open_check(node):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM siblings WHERE status = ? and sibling = ?''', ('open', node,))
-        data = cur.fetchone()
-        if data is None:
-            return False
-        else:
-            return True
 
 
-def update_sibling(node, state):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''UPDATE siblings SET state = ? WHERE sibling = ? and status = ?''', (state, node, 'open',))
+def time_left(timeout, deadline):	#timeout cut down to what is left before deadline (time.time() value or None)
+    if deadline is None:
+        return timeout
+    return min(timeout, deadline - time.time())
+
+
+def get_THIS_IS_A_BAD_NODE(hostnames, deadline=None):   #rippersnapper needs to enforce via cron on nodes for this to work correctly.
+    reasons = {}	#hostname: contents of THIS_IS_A_BAD_NODE.ncar, only for nodes that have it
+    if not hostnames:
+        return reasons
+    #one clush over every node, so a batch of dead nodes costs one timeout instead of one each
+    cmd = "{0} -t30 -u{1} -w {2} '[ -f /etc/THIS_IS_A_BAD_NODE.ncar ] && cat /etc/THIS_IS_A_BAD_NODE.ncar;'".format(clush_path, badnode_timeout, ','.join(hostnames))
+    result = run_cmd(cmd, time_left(int(badnode_timeout) + 35, deadline))
+    if result.timedout:
+        print('Timed out reading THIS_IS_A_BAD_NODE.ncar after %s seconds' % (badnode_timeout))
+    lines = {}
+    for line in result.stdout.splitlines():	#clush prefixes each line with "hostname: "
+        hostname, sep, text = line.partition(': ')
+        if sep and hostname in hostnames:
+            lines.setdefault(hostname, []).append(text)
+    for hostname in lines:
+        issuetitle = '\n'.join(lines[hostname]).strip()
+        if issuetitle:
+            reasons[hostname] = issuetitle
+    return reasons
 
 
-def get_THIS_IS_A_BAD_NODE(hostname):   #rippersnapper needs to enforce via cron on nodes for this to work correctly.
+def pull_pbsnodes(deadline=None):	#pbsnodes -av from pbsadmin, the input of every --auto pass
+    return run_cmd("{0} -t30 -u120 -Nw {1} {2} -av -Fdsv -D,".format(clush_path, pbsadmin, pbsnodes_path), time_left(160, deadline))
+
+
+#--auto and --daemon hold an fcntl lock on ctt.auto.lock while they run, so cron runs never pile up.
+#The kernel drops the lock however the holder ends (^C, kill -9), the pid, host and start time
+#written into the file are only there to say who holds it.
+auto_lockfile = 'ctt.auto.lock'
+_auto_lock = None
+
+def pid_alive(pid):
     try:
-        issuetitle = os.popen("{0} -t30 -Nw {1} '[ -f /etc/THIS_IS_A_BAD_NODE.ncar ] && cat /etc/THIS_IS_A_BAD_NODE.ncar;' 2>/dev/null".format(clush_path, hostname)).readlines()
-        issuetitle = ''.join(issuetitle)
-        issuetitle = issuetitle.strip()
-        if not issuetitle:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:	#someone else's process
+        return True
+    return True
+
+
+def lock_holder(text):	#(pid, host, started) from ctt.auto.lock, None when it is empty or half written
+    fields = text.split()
+    if len(fields) != 3 or not fields[0].isdigit() or not fields[2].isdigit():
+        return None
+    return int(fields[0]), fields[1], int(fields[2])
+
+
+def auto_lock():	#True when this process holds the --auto lock
+    #One lock file that is never removed, lockf alone decides who runs. Unlinking a stale file
+    #would let two runs lock different inodes of it.
+    global _auto_lock
+    fd = os.open(auto_lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        holder = lock_holder(os.read(fd, 200).decode(errors='replace'))
+        os.close(fd)
+        if holder is None:
+            print('--auto is already running (holder unknown), skipping this run')
             return False
-        else:
-            return issuetitle
-    except:
-        return False 
+        pid, host, started = holder
+        age = int(time.time()) - started
+        print('--auto is already running (pid %s on %s for %s seconds), skipping this run' % (pid, host, age))
+        if host == socket.gethostname() and pid_alive(pid) is False:	#stale, only a lock server (NFS) can keep it
+            print('pid %s is gone but its --auto lock is still held, check the lock daemon for %s' % (pid, auto_lockfile))
+        elif age > 3 * int(auto_deadline) and host == socket.gethostname():
+            print('pid %s has held the --auto lock for more than 3 x auto_deadline, check it is not hung' % (pid))
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, ('%s %s %s\n' % (os.getpid(), socket.gethostname(), int(time.time()))).encode())
+    _auto_lock = fd	#kept open, closing it would drop the lock
+    return True
+
+
+def pbsnodes_fatal(date,cluster,UserGroup,result):	#FATAL issue for a failed pull_pbsnodes()
+    details = "Can not get pbsnodes from %s" % (pbsadmin)
+    if result.timedout:
+        details = details + ", timed out"
+    elif result.stderr:
+        details = details + ": %s" % (result.stderr.strip())
+    cttissue = new_issue(date, '1', '---', 'open', \
+               cluster, 'FATAL', 'Can not get pbsnodes', \
+               details, 'FATAL', 'FATAL', \
+               'FATAL', 'o', 'FATAL', date, UserGroup)
+    log_history(cttissue, date, 'ctt', 'new issue')
 
 
 def run_auto(date,severity,assignedto,updatedby,cluster,UserGroup):
-    try:
-        pbs_states_csv = os.popen("{0} -t30 -Nw {1} {2} -av -Fdsv -D,".format(clush_path, pbsadmin, pbsnodes_path)).readlines()
-    except:
+    if auto_lock() is False:	#the last cron run is still going
+        exit(0)
+    deadline = time.time() + int(auto_deadline)
+    result = pull_pbsnodes(deadline)
+    if result.returncode != 0:
         print('Can not process --auto')
-        details = "Can not get pbsnodes from %s" % (pbsadmin)
-        cttissue = new_issue(date, '1', '---', 'open', \
-                   cluster, 'FATAL', 'Can not get pbsnodes', \
-                   details, 'FATAL', 'FATAL', \
-                   'FATAL', 'o', 'FATAL', date, UserGroup)
-        log_history(cttissue, date, 'ctt', 'new issue')
+        pbsnodes_fatal(date,cluster,UserGroup,result)
         exit(1)
 
+    openissues, opensibs = load_open_maps()
+    auto_pass(date,severity,updatedby,cluster,UserGroup,parse_pbsnodes(result.stdout.splitlines()),openissues,opensibs, \
+              load_fingerprints(),deadline)
+
+
+def auto_pass(date,severity,updatedby,cluster,UserGroup,snapshot,openissues,opensibs,fingerprints,deadline=None):	#one --auto pass over a pbsnodes snapshot
+    #openissues and opensibs come from load_open_maps() and are kept current here, so --daemon can reuse them.
+    #fingerprints (load_fingerprints()) is how every node looked after the last pass, only nodes that differ are checked.
+    #Past deadline the slow steps (new issues, force offline) are left for the next pass, the nodes they
+    #skipped keep an empty fingerprint so the next pass checks them again. Returns False when it stopped early.
+    complete = True
+    deferred = set()	#changed nodes this pass did not finish
+    sibupdates = []	#batched writes, see write_auto_changes()
+    issueupdates = []
+    historyrows = []
+
     newissuedict = {} 
     if int(maxissuesopen) != int(0):
-        open_count = get_open_count()
+        open_count = sum(len(issues) for issues in openissues.values())
         if open_count >= int(maxissuesopen):
             if maxissueopen_issue() is False:
                 print('Maximum number of issues (%s) reached for --auto' % (maxissuesopen))
@@ -182,47 +365,54 @@ def run_auto(date,severity,assignedto,updatedby,cluster,UserGroup):
             exit(1)
 
 
-    for line in pbs_states_csv:
-        splitline = line.split(",")
-        node = splitline[0] 
-        x,node = node.split('=')
-        state = splitline[5]
-        x,state = state.split('=')
+    automatch = None	#strict_node_match_auto = False in ctt.ini checks every node
+    if strict_node_match_auto.strip() != 'False':
+        automatch = set(strict_node_match_auto.replace(' ', '').split(','))
+
+    changed = []	#nodes whose pbs state or open issues/siblings moved since the last pass
+    for pbsnode in snapshot:
+        if automatch is not None and pbsnode.name not in automatch:
+            continue
+        if fingerprints.get(pbsnode.name) != node_fingerprint(pbsnode, openissues, opensibs):
+            changed.append(pbsnode)
+
+    for pbsnode in changed:
+        node = pbsnode.name
+        state = pbsnode.state
         #known pbs states: 'free', 'job-busy', 'job-exclusive', 
         #'resv-exclusive', offline, down, provisioning, wait-provisioning, stale, state-unknown
 
-        if strict_node_match_auto is not False:
-            if not (node in strict_node_match_auto):
-                continue
 
+        if node in opensibs:	#update sibling node state if open exists
+            if [sib for sib in opensibs[node] if sib[1] != state]:
+                for sib in opensibs[node]:
+                    sib[1] = state
+                sibupdates.append((state, node, 'open'))
 
-        if sibling_open_check(node) is True:	#update sibling node state if open exists
-            update_sibling(node, state)
-
-        if node_open_check(node) is True:  #update node state if open issue on node and state changed
-            cttissue = check_node_state(node,state)
-            if cttissue is None:	#no change in state
-                next
-            else:			#change in pbs state
-                cttissue = ''.join(cttissue)
-                update_issue(cttissue, 'state', state)  
-                update_issue(cttissue, 'updatedby', 'ctt')
-                update_issue(cttissue, 'updatedtime', date)
-                log_history(cttissue, date, 'ctt', '%s state changed to %s' % (node,state))
-
-        elif state in ('state-unknown', 'offline', 'down'):	#if no issue on node
-            if 'comment=' in ''.join(splitline):
-                for item in splitline:
-                    if 'comment=' in item:
-                        x,comment = item.split('=')
-                        if comment and node_open_check(node) is False:	#Prevents duplicate issues on node 
-                            hostname = node
-                            newissuedict[hostname] = comment
+        if node in openissues:  #update node state if open issue on node and state changed
+            for issue in openissues[node]:
+                if issue[1] != state:	#change in pbs state
+                    issue[1] = state
+                    issueupdates.append((state, 'ctt', date, issue[0]))
+                    historyrows.append((issue[0], date, 'ctt', '%s state changed to %s' % (node,state)))
 
-            else:
-                comment = 'Unknown Reason'
-                hostname = node
-                newissuedict[hostname] = comment
+        elif node in opensibs:	#sibling of another issue, no new issue
+            continue
+
+        elif pbsnode.states & {'state-unknown', 'offline', 'down'}:	#if no issue on node
+            if pbsnode.comment is None:
+                newissuedict[node] = 'Unknown Reason'
+            elif pbsnode.comment:
+                newissuedict[node] = pbsnode.comment
+
+    write_auto_changes(sibupdates, issueupdates, historyrows)
+    session_commit()	#checkpoint, the clush and pbsnodes calls below do not hold the write lock
+
+    if newissuedict and deadline is not None and time.time() >= deadline:
+        print('--auto deadline of %s seconds reached, %s new issues left for the next run' % (auto_deadline, len(newissuedict)))
+        deferred.update(newissuedict)
+        newissuedict = {}
+        complete = False
 
     if len(newissuedict) != 0 and len(newissuedict) <= int(maxissuesrun):
         status = 'open'
@@ -234,8 +424,10 @@ def run_auto(date,severity,assignedto,updatedby,cluster,UserGroup):
         updatedtime = updatedtime[:-10]
         assignedto = 'ctt'
         state = 'unknown' #initial state, next --auto will get actual state       
+        reasons = get_THIS_IS_A_BAD_NODE(list(newissuedict), deadline)
+        pbs_defer()	#one pbsnodes -o for all the new issues, not one each
         for hostname,comment in newissuedict.items():
-            issuetitle = get_THIS_IS_A_BAD_NODE(hostname)
+            issuetitle = reasons.get(hostname, False)
             if issuetitle is not False: 
                 issuedescription = issuetitle 
                 if comment:
@@ -247,6 +439,8 @@ def run_auto(date,severity,assignedto,updatedby,cluster,UserGroup):
                                  issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,UserGroup)                        
             #print("%s state is %s with comment: %s" %(hostname, state, comment))  #####
             log_history(cttissue, date, 'ctt', 'new issue')
+            openissues[hostname] = [[str(cttissue), state]]
+        pbs_flush(deadline)
 
     elif len(newissuedict) >= int(maxissuesrun):
         print('Maximum number of issues reached for --auto')                                                                  
@@ -260,65 +454,212 @@ def run_auto(date,severity,assignedto,updatedby,cluster,UserGroup):
         log_history(cttissue, date, 'ctt', 'new issue')                                                                                         
         exit(1)
 
+    session_commit()	#checkpoint, the new issues are kept if the force offline below is cut short
+
 #Force Offline
-    for line in pbs_states_csv:
-        splitline = line.split(",")
-        node = splitline[0]
-        x,node = node.split('=')
-        state = splitline[5]
-        x,state = state.split('=')
-
-        if sibling_open_check(node) is True:
-            if not re.search('offline', splitline[5]) and not re.search('offline', splitline[6]):
-                sibcttissue = get_sibcttissue(node)
-                if sibcttissue:
-                    nodes2drain = node.split(',')
-                    pbs_drain(sibcttissue, date, 'ctt', nodes2drain)
-                    update_sibling(node, 'offline')
-                    log_history(sibcttissue, date, 'ctt', 'Auto forced pbs offline')
-
-        if primary_node_open_check(node) is True:
-            if not re.search('offline', splitline[5]) and not re.search('offline', splitline[6]):   #update node state if open issue on node and state changed
-                cttissue = get_cttissue(node)
-                if cttissue:
-                    nodes2drain = node.split(',')
-                    pbs_drain(cttissue, date, 'ctt', nodes2drain)
-                    update_issue(cttissue,'state', 'offline')
-                    log_history(cttissue, date, 'ctt', 'Auto forced pbs offline')
-
-def primary_node_open_check(node):      #checks if node has open issue
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''
-            SELECT rowid FROM issues WHERE hostname = ? and status = "open"''', (node,))
-        data1 = cur.fetchone()
-        if data1 is None:
-            return False
+    sibupdates = []
+    issueupdates = []
+    historyrows = []
+    forcesibs = {}	#node: cttissue it is a sibling of
+    forceissues = {}	#node: cttissue open on it
+    for pbsnode in snapshot:	#every node with an open issue, an unchanged node here is a drain that failed last pass
+        node = pbsnode.name
+        if 'offline' in pbsnode.states or (node not in opensibs and node not in openissues):
+            continue
+        if node in opensibs:
+            forcesibs[node] = opensibs[node][0][0]
+        if node in openissues:   #update node state if open issue on node and state changed
+            forceissues[node] = openissues[node][0][0]
+
+    nodes2drain = list(forcesibs) + [node for node in forceissues if node not in forcesibs]
+    if nodes2drain and deadline is not None and time.time() >= deadline:	#offline again by the next pass
+        print('--auto deadline of %s seconds reached, not forcing %s nodes offline' % (auto_deadline, len(nodes2drain)))
+        nodes2drain = []
+        complete = False
+    failed = pbsnodes_batch('-o', nodes2drain, deadline)	#one pbsnodes -o for every node that needs it
+    for node in nodes2drain:
+        for cttissue in set([forcesibs.get(node), forceissues.get(node)]) - set([None]):
+            if node in failed:
+                historyrows.append((cttissue, date, 'ctt', 'Failed to drain %s' % (node)))
+            else:
+                historyrows.append((cttissue, date, 'ctt', 'Drained %s' % (node)))
+                historyrows.append((cttissue, date, 'ctt', 'Auto forced pbs offline'))
+        if node in failed:
+            print('Can not process pbs_drain() on %s' % (node))
+            continue
+        if node in forcesibs:
+            for sib in opensibs[node]:
+                sib[1] = 'offline'
+            sibupdates.append(('offline', node, 'open'))
+        if node in forceissues:
+            for issue in openissues[node]:
+                issue[1] = 'offline'
+                issueupdates.append(('offline', 'ctt', date, issue[0]))
+
+    write_auto_changes(sibupdates, issueupdates, historyrows)
+
+    fingerprintrows = []
+    for pbsnode in changed:	#as the nodes look now, after this pass wrote its changes
+        fingerprints[pbsnode.name] = ''	#never matches, checked again next pass
+        recorded = openissues.get(pbsnode.name, []) + opensibs.get(pbsnode.name, [])
+        if pbsnode.name not in deferred and not [entry for entry in recorded if entry[1] != pbsnode.state]:	#ctt.sqlite agrees with pbs
+            fingerprints[pbsnode.name] = node_fingerprint(pbsnode, openissues, opensibs)
+        fingerprintrows.append((pbsnode.name, fingerprints[pbsnode.name]))
+    write_fingerprints(fingerprintrows)
+    return complete
+
+
+
+def run_daemon(severity,assignedto,updatedby,cluster,UserGroup):	#ctt --daemon, --auto every daemon_interval seconds in one process
+    #The pbsnodes snapshot and the open issue/sibling maps stay in memory between polls. The maps are
+    #reloaded only when another ctt command wrote to ctt.sqlite (PRAGMA data_version moved), and a poll
+    #whose snapshot matches the last one does not touch the database at all.
+    #SIGTERM or SIGINT stops after the current poll, SIGHUP rereads ctt.ini.
+    received = []
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: received.append(signum))
+    if auto_lock() is False:	#a cron --auto or another --daemon is running
+        exit(1)
+    con = get_con()
+    openmaps = None
+    fingerprints = None
+    dataversion = None
+    lastsnapshot = None
+    pbsdown = False	#one FATAL issue per pbsnodes outage, not one per poll
+    print('ctt --daemon polling pbsnodes every %s seconds, pid %s' % (daemon_interval, os.getpid()))
+    while True:
+        if signal.SIGTERM in received or signal.SIGINT in received:
+            break
+        if signal.SIGHUP in received:
+            del received[:]
+            load_config()
+            severity = defaults['severity']
+            cluster = defaults['cluster']
+            lastsnapshot = None
+            print('Reloaded ctt.ini')
+        start = time.time()
+        deadline = start + int(auto_deadline)
+        date = datetime.datetime.now().isoformat()
+        result = pull_pbsnodes(deadline)
+        if result.returncode != 0:
+            if pbsdown is False:
+                print('Can not get pbsnodes from %s' % (pbsadmin))
+                pbsnodes_fatal(date,cluster,UserGroup,result)
+                session_commit()
+            pbsdown = True
+        else:
+            pbsdown = False
+            snapshot = parse_pbsnodes(result.stdout.splitlines())
+            if openmaps is None or con.execute('PRAGMA data_version').fetchone()[0] != dataversion:
+                dataversion = con.execute('PRAGMA data_version').fetchone()[0]	#before the load, a commit made after it reloads next poll
+                openmaps = load_open_maps()
+                fingerprints = load_fingerprints()
+                lastsnapshot = None
+            if snapshot != lastsnapshot:
+                try:
+                    if auto_pass(date,severity,updatedby,cluster,UserGroup,snapshot,openmaps[0],openmaps[1],fingerprints,deadline):
+                        lastsnapshot = snapshot	#a pass cut short by the deadline runs again on the same snapshot
+                except SystemExit:	#maxissuesopen/maxissuesrun end a cron --auto, the daemon polls again
+                    openmaps = None
+                session_commit()	#our own commits do not move data_version
+        while time.time() - start < int(daemon_interval) and not received:
+            time.sleep(1)
+    print('ctt --daemon stopped')
+
+#One node from pbsnodes -av -Fdsv. state is the raw pbs state string (what ctt stores),
+#states is the same split into a set, comment and jobs are None when pbs did not report them.
+PbsNode = namedtuple('PbsNode', 'name state states comment jobs resources_available')
+
+
+def split_dsv(line, delimiter=','):	#pbs escapes a delimiter inside a value with a backslash
+    if '\\' not in line:
+        return line.split(delimiter)
+    fields = []
+    field = []
+    escaped = False
+    for char in line:
+        if escaped:
+            field.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == delimiter:
+            fields.append(''.join(field))
+            field = []
         else:
-            return True
+            field.append(char)
+    fields.append(''.join(field))
+    return fields
+
+
+def parse_pbsnodes(lines, delimiter=','):	#pbsnodes -av -Fdsv output to a list of PbsNode
+    snapshot = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        fields = split_dsv(line, delimiter)
+        name = fields[0].partition('=')[2]	#first field is always the node name
+        state = comment = jobs = None
+        resources_available = {}
+        for field in fields[1:]:
+            key, x, value = field.partition('=')
+            if key == 'state':
+                state = value
+            elif key == 'comment':
+                comment = value
+            elif key == 'jobs':
+                jobs = value
+            elif key.startswith('resources_available.'):
+                resources_available[key[20:]] = value
+        if not name or state is None:
+            continue
+        snapshot.append(PbsNode(name, state, frozenset(state.split(',')), comment, jobs, resources_available))
+    return snapshot
+
+
+def load_open_maps():	#used by --auto, all open issues and siblings with one query each
+    con = get_con()
+    cur = con.cursor()
+    openissues = {}	#hostname: [[cttissue, state], ...]
+    cur.execute('''SELECT cttissue, hostname, state FROM issues WHERE status = ? ORDER BY id''', ('open',))
+    for cttissue, hostname, state in cur:
+        openissues.setdefault(hostname, []).append([cttissue, state])
+    opensibs = {}	#sibling: [[cttissue, state], ...]
+    cur.execute('''SELECT cttissue, sibling, state FROM siblings WHERE status = ? ORDER BY id''', ('open',))
+    for cttissue, sibling, state in cur:
+        opensibs.setdefault(sibling, []).append([cttissue, state])
+    return openissues, opensibs
+
+
+def node_fingerprint(pbsnode, openissues, opensibs):	#hash of everything an --auto pass decides a node on
+    issues = [(str(cttissue), state) for cttissue, state in openissues.get(pbsnode.name, [])]
+    sibs = [(str(cttissue), state) for cttissue, state in opensibs.get(pbsnode.name, [])]
+    facts = repr((pbsnode.state, pbsnode.comment, pbsnode.jobs, issues, sibs))
+    return hashlib.blake2b(facts.encode(), digest_size=8).hexdigest()
+
+
+def load_fingerprints():	#node_fingerprints table, hostname: fingerprint
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT hostname, fingerprint FROM node_fingerprints''')
+    return dict(cur.fetchall())
 
 
-def get_sibcttissue(node):	#get sibling cttissue number from node (if open)
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT cttissue FROM siblings WHERE sibling = ? and status = ?''', (node, 'open'))
-        cttissue = cur.fetchone()
-        if cttissue:
-            cttissue = ''.join(cttissue) #tuple to str
-            return cttissue
+def write_fingerprints(rows):
+    con = get_con()
+    cur = con.cursor()
+    cur.executemany('''INSERT OR REPLACE INTO node_fingerprints(hostname, fingerprint) VALUES(?, ?)''', rows)
 
 
-def get_cttissue(node):		#get cttissue number from node name (if open)
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT cttissue FROM issues WHERE hostname = ? and status = ?''', (node, 'open'))
-        cttissue = cur.fetchone()
-        if cttissue:
-            cttissue = ''.join(cttissue) #tuple to str
-            return cttissue
+def write_auto_changes(sibupdates, issueupdates, historyrows):	#state changes decided by --auto, one executemany each
+    con = get_con()
+    cur = con.cursor()
+    cur.executemany('''UPDATE siblings SET state = ? WHERE sibling = ? and status = ?''', sibupdates)
+    cur.executemany('''UPDATE issues SET state = ?, updatedby = ?, updatedtime = ? WHERE cttissue = ?''', issueupdates)
+    cur.executemany('''INSERT INTO history(
+             cttissue,date,updatedby,info)
+             VALUES(?, ?, ?, ?)''', historyrows)
 
 
 def test_arg_size(arg,what,maxchars):
@@ -328,83 +669,75 @@ def test_arg_size(arg,what,maxchars):
         exit(1)
 
 
-def update_ticket(cttissue, ticketvalue):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT * FROM issues WHERE cttissue = ?''', (cttissue,))
-        for row in cur:
-            ticketlist = (row[4])
-            ticketlist = ticketlist.split(',')
-            if '---' in ticketlist:
-                ticketlist.remove('---')
-            if ticketvalue in ticketlist:
-                ticketlist.remove(ticketvalue)
-            else:
-                ticketlist.append(ticketvalue)
-            ticketlist = ','.join(ticketlist)
-            if not ticketlist:
-                ticketlist = '---'
-            cur.execute('''UPDATE issues SET ticket = ? WHERE cttissue = ?''', (ticketlist, cttissue,))
+#external tickets live in issue_tickets, issues.ticket keeps the ','-joined list for display
+def update_ticket(cttissue, ticketvalue):	#toggles ticketvalue on the issue
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''DELETE FROM issue_tickets WHERE cttissue = ? and ticket = ?''', (cttissue, ticketvalue))
+    if cur.rowcount == 0:
+        cur.execute('''INSERT INTO issue_tickets(cttissue, ticket) VALUES(?, ?)''', (cttissue, ticketvalue))
+    cur.execute('''SELECT ticket FROM issue_tickets WHERE cttissue = ? ORDER BY id ASC''', (cttissue,))
+    ticketlist = ','.join(row[0] for row in cur)
+    if not ticketlist:
+        ticketlist = '---'
+    cur.execute('''UPDATE issues SET ticket = ? WHERE cttissue = ?''', (ticketlist, cttissue,))
 
 
+def split_tickets(ticket):	#'HPE1,HPE2' -> ['HPE1', 'HPE2'], '---' is no ticket
+    return [t for t in (ticket or '').split(',') if t and t != '---']
+
+
+#issue_views has a row for every group that has seen the current version of an issue. UNSEEN is
+#the ctt.ini groups without a row, the issues.viewtracker column is no longer kept up to date.
 def view_tracker_new(cttissue,UserGroup,viewnotices):        #used for new issues and updates
-    userlist = []                               
-    for user in viewnotices.split(' '):
-        if UserGroup == user:
-            next       
-        else:
-            userlist.append(user)       
-    if userlist:
-        userlist = '.'.join(userlist)
-    else:
-        userlist = "---"
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''DELETE FROM issue_views WHERE cttissue = ? and usergroup != ?''', (cttissue, UserGroup))
+    cur.execute('''INSERT OR REPLACE INTO issue_views(cttissue, usergroup, last_seen) VALUES(?, ?, ?)''', \
+                (cttissue, UserGroup, datetime.datetime.now().isoformat()))
 
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''UPDATE issues SET viewtracker = ? WHERE cttissue = ?''', (userlist, cttissue))
 
+def view_tracker_update(cttissue,UserGroup):	#used when a user runs --show, only writes the first time a group sees it
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT 1 FROM issue_views WHERE cttissue = ? and usergroup = ?''', (cttissue, UserGroup))
+    if cur.fetchone() is None:
+        cur.execute('''INSERT OR REPLACE INTO issue_views(cttissue, usergroup, last_seen) VALUES(?, ?, ?)''', \
+                    (cttissue, UserGroup, datetime.datetime.now().isoformat()))
+
+
+def usergroups_cte():	#the [USERS] groups as a usergroups(ord, usergroup) table, in ctt.ini order
+    rows = ' UNION ALL '.join('SELECT ?, ?' for group in usersdict) or 'SELECT NULL, NULL WHERE 0'
+    params = [value for ord, group in enumerate(usersdict) for value in (ord, group)]
+    return '''WITH usergroups(ord, usergroup) AS (%s) ''' % (rows), params
 
-def view_tracker_update(cttissue,UserGroup):	#used to update viewtracker column when a user runs --show
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT * FROM issues WHERE cttissue = ?''', (cttissue,))
-        for row in cur:
-            userlist = (row[16])
-            userlist = userlist.split('.')
-            if UserGroup in userlist:
-                userlist.remove(UserGroup)
-            userlist = '.'.join(userlist)
-            if not userlist:
-                userlist = '---'
-            cur.execute('''UPDATE issues SET viewtracker = ? WHERE cttissue = ?''', (userlist, cttissue))
-
-
-def get_pbs_sib_state(node):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT state FROM siblings WHERE sibling = ? and status = ?''', (node, 'open',))
-        state = cur.fetchone()
-        return state        
+
+#anti-join, the groups without an issue_views row for issues.cttissue
+unseen_where = '''NOT EXISTS (SELECT 1 FROM issue_views WHERE issue_views.cttissue = issues.cttissue
+                  and issue_views.usergroup = usergroups.usergroup)'''
+
+def get_unseen(cttissue):	#UNSEEN for one issue, '---' when every group has seen it
+    cte, params = usergroups_cte()
+    con = get_con()
+    cur = con.cursor()
+    cur.execute(cte + '''SELECT usergroups.usergroup FROM usergroups, (SELECT ? AS cttissue) AS issues
+                WHERE %s ORDER BY usergroups.ord''' % (unseen_where), params + [cttissue])
+    return '.'.join(row[0] for row in cur) or '---'
 
 
 def get_hostname(cttissue):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT hostname FROM issues WHERE cttissue = ? and status = ?''', (cttissue,'open',))
-        hostname = cur.fetchone()
-        if hostname:
-            return hostname
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT hostname FROM issues WHERE cttissue = ? and status = ?''', (cttissue,'open',))
+    hostname = cur.fetchone()
+    if hostname:
+        return hostname
 
 
 def add_siblings(cttissue,date,updatedby): #need to run a drain function (set_pbs_offline()) on the siblings when adding!!!
     if issue_open_check(cttissue) is False:  #Added this check 2/2/2021, Jon
         print("Issue %s is not open" % (cttissue))
-        exit()    
+        exit(1)
     node = get_hostname(cttissue)
     node = ''.join(node)	#tuple to str
     try:
@@ -422,20 +755,48 @@ def add_siblings(cttissue,date,updatedby): #need to run a drain function (set_pb
 
     for sib in nodes:
         if node != sib:
-            con = SQL.connect('ctt.sqlite')
-            with con:
-                cur = con.cursor()
-                cur.execute('''INSERT INTO siblings(
-                        cttissue,date,status,parent,sibling,state)
-                        VALUES(?, ?, ?, ?, ?, ?)''',
-                        (cttissue, date, 'open', node, sib, '---'))
-                #print("Attached sibling %s to issue %s" % (sib,cttissue))  #jon1
+            con = get_con()
+            cur = con.cursor()
+            cur.execute('''INSERT INTO siblings(
+                    cttissue,date,status,parent,sibling,state)
+                    VALUES(?, ?, ?, ?, ?, ?)''',
+                    (cttissue, date, 'open', node, sib, '---'))
+            #print("Attached sibling %s to issue %s" % (sib,cttissue))  #jon1
 
         info = "Attached sibling %s to issue" % (sib)
         log_history(cttissue, date, updatedby, info)
     return
 
 
+def expand_range(ranges):	#'0-3,7,09-11' -> ['0', '1', '2', '3', '7', '09', '10', '11'], leading zeros set the width
+    values = []
+    for item in ranges.split(','):
+        item, _, step = item.partition('/')
+        low, _, high = item.partition('-')
+        if not high:
+            high = low
+        if not (low.isdigit() and high.isdigit() and (not step or step.isdigit())) or int(low) > int(high):
+            raise ValueError(item)
+        width = len(low) if len(low) > 1 and low.startswith('0') else 0
+        values.extend('%0*d' % (width, i) for i in range(int(low), int(high) + 1, int(step or 1)))
+    return values
+
+
+def expand_nodeset(nodeset):	#ClusterShell style node sets, 'r1i[0-3]n[0-17],casper[01-36]' -> every node name
+    nodes = []
+    nodeset = re.sub(r'\s*,\s*', ',', nodeset.strip())	#'n1, n2' as written in ctt.ini
+    patterns = re.findall(r'(?:[^,\[]|\[[^\]]*\])+', nodeset)
+    if ','.join(patterns) != nodeset:	#unbalanced [ or an empty name
+        raise ValueError(nodeset)
+    for pattern in patterns:
+        parts = re.split(r'\[([^\]]*)\]', pattern)	#text, range, text, range, ... text
+        if '[' in ''.join(parts[::2]) or ']' in ''.join(parts[::2]):
+            raise ValueError(pattern)
+        choices = [[part] if i % 2 == 0 else expand_range(part) for i, part in enumerate(parts)]
+        nodes.extend(''.join(combo) for combo in product(*choices))
+    return list(dict.fromkeys(nodes))	#drop repeats, keep the order
+
+
 def node_to_tuple(n):	#used by add_siblings()
     m = re.match("([rR])([0-9]+)([iI])([0-9]+)([nN])([0-9]+)", n)
     if m is not None:
@@ -462,30 +823,6 @@ def resolve_siblings(node): 	#used by add_siblings()
     return result
 
 
-def check_node_state(node, state): 	#checks if node has open issue, returns cttissue number
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT cttissue FROM issues WHERE hostname = ? and state != ? and status = ?''', (node,state,'open',))
-        result = cur.fetchone()
-        if result:
-            return result
-
-
-def node_open_check(node):	#checks if node has open issue
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''
-            SELECT rowid FROM siblings WHERE sibling = ? and status = "open"''', (node,))
-        data1 = cur.fetchone()
-        cur.execute('''
-            SELECT rowid FROM issues WHERE hostname = ? and status = "open"''', (node,))
-        data2 = cur.fetchone()
-        if data1 is None and data2 is None:
-            return False
-        else:
-            return True
 
 
 
@@ -501,29 +838,33 @@ def get_history(cttissue):	#used only when issuing --show with -d option
         fmt = cols.format
         print("\n----------------------------------------")    
         print(fmt("DATE", "UPDATE.BY", "INFO"))    
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''SELECT * FROM history WHERE cttissue = ?''', (cttissue,))
-            for row in cur:
-                date = (row[2][0:16])
-                updatedby = (row[3])
-                info = (row[4])
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''SELECT * FROM history WHERE cttissue = ?''', (cttissue,))
+        for row in cur:
+            date = (row[2][0:16])
+            updatedby = (row[3])
+            info = (row[4])
 
-                print(fmt("%s" % date, "%s" % updatedby, "%s" % textwrap.fill(info, width=80)))
+            print(fmt("%s" % date, "%s" % updatedby, "%s" % textwrap.fill(info, width=80)))
     else:
         return
 
 
+def log_histories(rows):	#[(cttissue, date, updatedby, info), ...] for issues that are known to exist
+    con = get_con()
+    cur = con.cursor()
+    cur.executemany('''INSERT INTO history(cttissue,date,updatedby,info) VALUES(?, ?, ?, ?)''', rows)
+
+
 def log_history(cttissue, date, updatedby, info): 
     if issue_deleted_check(cttissue) is False or issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''INSERT INTO history(
-                     cttissue,date,updatedby,info)
-                     VALUES(?, ?, ?, ?)''',
-                     (cttissue, date, updatedby, info))
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''INSERT INTO history(
+                 cttissue,date,updatedby,info)
+                 VALUES(?, ?, ?, ?)''',
+                 (cttissue, date, updatedby, info))
         return
     else:
         return
@@ -531,388 +872,629 @@ def log_history(cttissue, date, updatedby, info):
 
 def get_issue_full(cttissue):	#used for the --show option
     if issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''SELECT * FROM issues WHERE cttissue = ?''', (cttissue,))
-            for row in cur:
-                cttissue = (row[1])  
-                date = (row[2][0:16])
-                severity = (row[3])
-                ticket = (row[4])
-                status = (row[5])
-                cluster = (row[6])
-                hostname = (row[7])
-                issuetitle = (row[8])  
-                issuedescription = (row[9])
-                assignedto = (row[10])
-                issueoriginator = (row[11])
-                updatedby = (row[12])
-                issuetype = (row[13])
-                state = (row[14])
-                updatedtime = (row[15][0:16])
-                print("CTT Issue: %s" % (cttissue))
-                print("External Ticket: %s" % (ticket))
-                print("Date Opened: %s" % (date))
-                print("Assigned To: %s" % (assignedto))
-                print("Issue Originator: %s" % (issueoriginator))
-                print("Last Updated By: %s" % (updatedby))
-                print("Last Update Time: %s" % (updatedtime))
-                print("Severity: %s" % (severity))
-                print("Status: %s" % (status))
-                print("Type: %s" % (issuetype))
-                print("Cluster: %s" % (cluster))
-                print("Hostname: %s" % (hostname))
-                print("Node State: %s" % (state))
-                if check_has_sibs(cttissue) is True:
-                    print("Attached Siblings:")
-                    sibs = resolve_siblings(hostname)
-                    for node in sibs:
-                        if node != hostname:
-                            state = get_pbs_sib_state(node)
-                            state = ' '.join(state)
-                            print('%s state = %s' % (node,state))
-                else:
-                    print("Attached Siblings: None")
-                print("----------------------------------------")
-                print("\nIssue Title:\n%s" % (issuetitle))
-                print("\nIssue Description:") 
-                print(textwrap.fill(issuedescription, width=60))
-                print("\n----------------------------------------")
-                get_comments(cttissue)
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''SELECT * FROM issues WHERE cttissue = ?''', (cttissue,))
+        for row in cur:
+            cttissue = (row[1])  
+            date = (row[2][0:16])
+            severity = (row[3])
+            ticket = (row[4])
+            status = (row[5])
+            cluster = (row[6])
+            hostname = (row[7])
+            issuetitle = (row[8])  
+            issuedescription = (row[9])
+            assignedto = (row[10])
+            issueoriginator = (row[11])
+            updatedby = (row[12])
+            issuetype = (row[13])
+            state = (row[14])
+            updatedtime = (row[15][0:16])
+            print("CTT Issue: %s" % (cttissue))
+            print("External Ticket: %s" % (ticket))
+            print("Date Opened: %s" % (date))
+            print("Assigned To: %s" % (assignedto))
+            print("Issue Originator: %s" % (issueoriginator))
+            print("Last Updated By: %s" % (updatedby))
+            print("Last Update Time: %s" % (updatedtime))
+            print("Severity: %s" % (severity))
+            print("Status: %s" % (status))
+            print("Type: %s" % (issuetype))
+            print("Cluster: %s" % (cluster))
+            print("Hostname: %s" % (hostname))
+            print("Node State: %s" % (state))
+            sibs = get_open_siblings(cttissue)
+            if sibs:
+                print("Attached Siblings:")
+                for node, state in sibs:
+                    if node != hostname:
+                        print('%s state = %s' % (node,state))
+            else:
+                print("Attached Siblings: None")
+            print("----------------------------------------")
+            print("\nIssue Title:\n%s" % (issuetitle))
+            print("\nIssue Description:") 
+            print(textwrap.fill(issuedescription, width=60))
+            print("\n----------------------------------------")
+            get_comments(cttissue)
     else:
         print("Issue not found")
 
 
 def get_comments(cttissue):	#used for --show option (displays the comments)
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''SELECT * FROM comments WHERE cttissue = ?''', (cttissue,))
-            for row in cur:
-                date = (row[2][0:16])
-                updatedby = (row[3])
-                comment = (row[4])
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''SELECT * FROM comments WHERE cttissue = ?''', (cttissue,))
+        for row in cur:
+            date = (row[2][0:16])
+            updatedby = (row[3])
+            comment = (row[4])
 
-                print("\nComment by: %s at %s" % (updatedby, date))
-                print(textwrap.fill(comment, width=60))
+            print("\nComment by: %s at %s" % (updatedby, date))
+            print(textwrap.fill(comment, width=60))
 
 
 def comment_issue(cttissue, date, updatedby, newcomment,UserGroup):
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''INSERT INTO comments(
-                    cttissue,date,updatedby, comment)
-                    VALUES(?, ?, ?, ?)''',
-                    (cttissue, date, updatedby, newcomment))
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''INSERT INTO comments(
+                cttissue,date,updatedby, comment)
+                VALUES(?, ?, ?, ?)''',
+                (cttissue, date, updatedby, newcomment))
     else: 
         print("Can't add comment to %s. Issue not found or deleted" % (cttissue))
-        exit()
+        exit(1)
 
     view_tracker_new(cttissue,UserGroup,viewnotices)   
     return
 
 
 def issue_exists_check(cttissue):	#checks if a cttissue exists
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM issues WHERE cttissue = ?''', (cttissue,))
-        data=cur.fetchone()
-        if data is None:
-            return False
-        else:
-            return True
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT rowid FROM issues WHERE cttissue = ?''', (cttissue,))
+    data=cur.fetchone()
+    if data is None:
+        return False
+    else:
+        return True
 
 
 def update_issue(cttissue, updatewhat, updatedata):        
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''UPDATE issues SET {0} = ? WHERE cttissue = ?'''.format(updatewhat), (updatedata, cttissue))    
-            #print("Issue %s updated: %s" % (cttissue, updatewhat))  #jon test
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''UPDATE issues SET {0} = ? WHERE cttissue = ?'''.format(updatewhat), (updatedata, cttissue))    
+        #print("Issue %s updated: %s" % (cttissue, updatewhat))  #jon test
     else:
         print("Issue %s not found or deleted" % (cttissue))
     
 
-def check_has_sibs(cttissue):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM siblings WHERE cttissue = ? and status = ?''', (cttissue,'open'))
-        data = cur.fetchone()
-        if data is None:
-            next
-        else:
-            return True
+def live_issues(issue_list):	#the issues in issue_list that exist and are not deleted
+    con = get_con()
+    cur = con.cursor()
+    found = set()
+    for i in range(0, len(issue_list), 500):	#stay under the sqlite bound parameter limit
+        chunk = issue_list[i:i + 500]
+        cur.execute('''SELECT cttissue FROM issues WHERE status != ? and cttissue IN (%s)''' % (', '.join('?' * len(chunk))), \
+                    ['deleted'] + chunk)
+        found.update(row[0] for row in cur)
+    return found
+
+
+def update_issues(issue_list, changes, date, updatedby, UserGroup, siblings=False):	#used for the --update option
+    #changes: [(column, value, history info), ...] applied to every issue in one UPDATE,
+    #column None is a ticket toggle. siblings=True attaches siblings first (-x h!).
+    issue_list = [cttissue for cttissue in issue_list if cttissue]
+    found = live_issues(issue_list)
+    columns = [column for column, value, info in changes if column] + ['updatedby', 'updatedtime']
+    values = [value for column, value, info in changes if column] + [updatedby, date]
+    setcols = ', '.join('%s = ?' % (column) for column in columns)
+    history = []
+    missing = False
+    con = get_con()
+    cur = con.cursor()
+    for cttissue in issue_list:
+        if cttissue not in found:
+            print("Issue %s not found or deleted" % (cttissue))
+            missing = True
+            continue
+        if siblings is True:
+            add_siblings(cttissue,date,updatedby)
+        for column, value, info in changes:
+            if column is None:
+                update_ticket(cttissue, value)
+        cur.execute('''UPDATE issues SET %s WHERE cttissue = ?''' % (setcols), values + [cttissue])
+        view_tracker_new(cttissue,UserGroup,viewnotices)
+        history.extend((cttissue, date, updatedby, info) for column, value, info in changes)
+    cur.executemany('''INSERT INTO history(cttissue,date,updatedby,info) VALUES(?, ?, ?, ?)''', history)
+    if missing is True:	#the others are updated, but the command did not do all it was asked
+        exit(1)
+
 
+def check_date(datevalue):	#--since/--until, ctt stores dates as ISO8601 text
+    if datevalue:
+        try:	#fromisoformat on 3.11 also takes 20240101, which sorts wrong against the stored text
+            if not re.match(r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?)?$', datevalue):
+                raise ValueError
+            datetime.datetime.fromisoformat(datevalue)
+        except ValueError:
+            print('%s is not a date, use YYYY-MM-DD or YYYY-MM-DDTHH:MM' % (datevalue))
+            exit(1)
 
-def get_issues(statustype):	#used for the --list option
+
+def list_where(statustype, filters):	#WHERE clause and parameters for --list -s and the --list filters
+    #filters keys (all optional): cluster, assignedto, severity, issuetype, since, until, after, unseen (a group), ticket
+    where = []
+    params = []
+    if 'all' not in statustype:
+        where.append('status = ?')
+        params.append(statustype)
+    for column in ('cluster', 'assignedto', 'severity', 'issuetype'):
+        if filters.get(column):
+            where.append('%s = ?' % (column))
+            params.append(filters[column])
+    if filters.get('since'):	#date is ISO8601 text, so string order is time order
+        where.append('date >= ?')
+        params.append(filters['since'])
+    if filters.get('until'):
+        where.append('date < ?')
+        params.append(filters['until'])
+    if filters.get('after'):	#keyset pagination, the page after issue X in id order
+        where.append('id > (SELECT id FROM issues WHERE cttissue = ?)')
+        params.append(filters['after'])
+    if filters.get('unseen'):	#anti-join, issues the group has no issue_views row for
+        where.append('NOT EXISTS (SELECT 1 FROM issue_views WHERE issue_views.cttissue = issues.cttissue and issue_views.usergroup = ?)')
+        params.append(filters['unseen'])
+    if filters.get('ticket'):	#reverse lookup through the issue_tickets ticket index
+        where.append('cttissue IN (SELECT cttissue FROM issue_tickets WHERE ticket = ?)')
+        params.append(filters['ticket'])
+    if not where:
+        return '', params
+    return ' WHERE ' + ' and '.join(where), params
+
+
+def list_issues(statustype, filters=None):	#used by the --list options, issues with their open siblings in one query
+    #yields (issue row, [(sibling, sibling state), ...]) in id order, --limit counts issues not sibling rows
+    #the issue row is issues.* as stored with UNSEEN (get_unseen()) added at the end, row[17]
+    filters = filters or {}
+    where, params = list_where(statustype, filters)
+    limit = filters.get('limit') or -1	#-1 is no limit in sqlite
+    cte, cteparams = usergroups_cte()
+    con = get_con()
+    cur = con.cursor()
+    cur.execute(cte + '''SELECT issues.*, siblings.sibling, siblings.state
+             FROM (SELECT issues.*, (SELECT ifnull(group_concat(usergroup, '.'), '---')
+                         FROM (SELECT usergroups.usergroup FROM usergroups WHERE %s ORDER BY usergroups.ord)) AS unseen
+                   FROM issues%s ORDER BY id ASC LIMIT ?) AS issues
+             LEFT JOIN siblings ON siblings.cttissue = issues.cttissue and siblings.status = ?
+             ORDER BY issues.id ASC, siblings.id ASC''' % (unseen_where, where), cteparams + params + [limit, 'open'])
+    ncols = len(cur.description) - 2	#issues.*, unseen, then the two sibling columns
+    for id, rows in groupby(cur, key=lambda row: row[0]):
+        rows = list(rows)
+        yield rows[0][:ncols], [(row[ncols], row[ncols + 1]) for row in rows if row[ncols] is not None]
+
+
+#--json, --csv and --ndjson for --list, --show and --stats. Rows are written as they come off
+#the cursor, the whole result is never built in memory.
+def add_output_args(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--json', action='store_const', const='json', dest='outformat')
+    group.add_argument('--csv', action='store_const', const='csv', dest='outformat')
+    group.add_argument('--ndjson', action='store_const', const='ndjson', dest='outformat')
+
+
+def table_columns(table):
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''PRAGMA table_info(%s)''' % (table))
+    return [row[1] for row in cur.fetchall()]
+
+
+def csv_value(value):	#embedded lists (siblings) in one csv cell, "node:state node:state"
+    if isinstance(value, list):
+        return ' '.join(':'.join('%s' % (field) for field in item.values()) for item in value)
+    return value
+
+
+def stdout_closed():	#the reader went away (ctt --list --csv | head), not an error
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())	#python flushes stdout again at exit
+    exit(0)
+
+
+def write_records(outformat, columns, records):	#records are tuples in columns order
+    out = sys.stdout
+    try:
+        if outformat == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for record in records:
+                writer.writerow([csv_value(value) for value in record])
+        elif outformat == 'ndjson':
+            for record in records:
+                out.write(json.dumps(dict(zip(columns, record))) + '\n')
+        else:	#json, one array
+            out.write('[')
+            sep = '\n'
+            for record in records:
+                out.write(sep + json.dumps(dict(zip(columns, record))))
+                sep = ',\n'
+            out.write('\n]\n')
+        out.flush()
+    except BrokenPipeError:
+        stdout_closed()
+
+
+def list_records(statustype, filters, outformat):	#--list --json/--csv/--ndjson
+    columns = table_columns('issues') + ['unseen', 'siblings']	#viewtracker as stored, unseen is the UNSEEN column
+    records = (row + ([{'sibling': node, 'state': state} for node, state in sibs],) \
+               for row, sibs in list_issues(statustype, filters))
+    write_records(outformat, columns, records)
+
+
+def show_records(cttissue, outformat):	#--show --json/--csv/--ndjson, siblings, comments and history embedded
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT * FROM issues WHERE cttissue = ?''', (cttissue,))
+    row = cur.fetchone()
+    if row is None:
+        print("Issue not found")
+        return
+    columns = [col[0] for col in cur.description] + ['unseen']	#viewtracker as stored, unseen is the UNSEEN column
+    row = row + (get_unseen(cttissue),)
+    sections = [
+        ('siblings', '''SELECT sibling, state, date FROM siblings WHERE cttissue = ? and status = ? ORDER BY id''', (cttissue, 'open')),
+        ('comments', '''SELECT date, updatedby, comment FROM comments WHERE cttissue = ? ORDER BY id''', (cttissue,)),
+        ('history', '''SELECT date, updatedby, info FROM history WHERE cttissue = ? ORDER BY id''', (cttissue,)),
+    ]
+    out = sys.stdout
+    if outformat == 'csv':	#the issue, then one csv table per section with a blank line between
+        write_records('csv', columns, [row])
+        for name, query, params in sections:
+            cur.execute(query, params)
+            out.write('\n')
+            write_records('csv', [col[0] for col in cur.description], cur)
+        return
+    try:
+        out.write(json.dumps(dict(zip(columns, row)))[:-1])	#one object, sections streamed in before the closing brace
+        for name, query, params in sections:
+            cur.execute(query, params)
+            names = [col[0] for col in cur.description]
+            out.write(', %s: [' % (json.dumps(name)))
+            sep = ''
+            for item in cur:
+                out.write(sep + json.dumps(dict(zip(names, item))))
+                sep = ', '
+            out.write(']')
+        out.write('}\n')
+        out.flush()
+    except BrokenPipeError:
+        stdout_closed()
+
+
+def get_open_siblings(cttissue):	#[(sibling, state), ...] attached to an issue
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT sibling, state FROM siblings WHERE cttissue = ? and status = ? ORDER BY id''', (cttissue, 'open'))
+    return cur.fetchall()
+
+
+def get_issues(statustype, filters=None):	#used for the --list option
     cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<16}{5:<6}{6:<7}{7:<8}{8:<12}{9:<28}"
     fmt = cols.format    
     print(fmt("ISSUE", "DATE", "TICKET", "HOSTNAME", "STATE", "SEV", "TYPE", "OWNER", "UNSEEN", "TITLE (25 chars)"))
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        if 'all' in statustype:
-            cur.execute('''SELECT * FROM issues ORDER BY id ASC''')
+    for row, sibs in list_issues(statustype, filters):
+        cttissue = (row[1])  #broke up all cells just-in-case we need them. Can remove later what isnt needed.
+        date = (row[2][0:16])
+        severity = (row[3])
+        ticket = (row[4])
+        if '---' not in ticket:
+            ticket = 'yes'
+        status = (row[5])
+        cluster = (row[6])
+        hostname = (row[7])
+        issuetitle = (row[8][:25])  #truncated to xx characters 
+        issuedescription = (row[9])
+        assignedto = (row[10])
+        issueoriginator = (row[11])
+        updatedby = (row[12])
+        issuetype = (row[13])
+        state = (row[14])
+        updatedtime = (row[15][0:16])
+        viewtracker = (row[17])	#UNSEEN from list_issues()
+        #print(bcolors.WARNING + "TEST" + bcolors.ENDC)
+        if severity  == 1:
+            print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, \
+                      "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % issuetitle) + bcolors.ENDC)
         else:
-            cur.execute('''SELECT * FROM issues WHERE status = ? ORDER BY id ASC''', (statustype,))
-        for row in cur:
-            cttissue = (row[1])  #broke up all cells just-in-case we need them. Can remove later what isnt needed.
-            date = (row[2][0:16])
-            severity = (row[3])
-            ticket = (row[4])
-            if '---' not in ticket:
-                ticket = 'yes'
-            status = (row[5])
-            cluster = (row[6])
-            hostname = (row[7])
-            issuetitle = (row[8][:25])	#truncated to xx characters 
-            issuedescription = (row[9])
-            assignedto = (row[10])
-            issueoriginator = (row[11])
-            updatedby = (row[12])
-            issuetype = (row[13])
-            state = (row[14])
-            updatedtime = (row[15][0:16])
-            viewtracker = (row[16])
-            #print(bcolors.WARNING + "TEST" + bcolors.ENDC)
-            if severity  == 1:
-                print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, \
-                          "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % issuetitle) + bcolors.ENDC)
-            else:
-                 print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, \
-                          "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % issuetitle)) 
+             print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, \
+                      "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % issuetitle)) 
 
-            if check_has_sibs(cttissue) is True:
-                sibs = resolve_siblings(hostname)
-                for node in sibs:
-                    if node != hostname:
-                        state = get_pbs_sib_state(node) 
-                        state = ''.join(state)
-                        issuetitle = "Sibling to %s" % (hostname)
-                        issuetype = 'o'
-                        print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % node, "%s" % state, \
-                                  "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, \
-                                  "%s" % issuetitle ))
+        for node, state in sibs:
+            if node != hostname:
+                issuetitle = "Sibling to %s" % (hostname)
+                issuetype = 'o'
+                print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % node, "%s" % state, \
+                          "%s" % severity, "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, \
+                          "%s" % issuetitle ))
 
 
-def get_issues_vv(statustype):   # -vv option
+def get_issues_vv(statustype, filters=None):   # -vv option
     cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<16}{5:<6}{6:<7}{7:<8}{8:<12}{9:<12}{10:<8}{11:<10}{12:<19}{13:<10}{14:<20}{15:<22}"  
     fmt = cols.format
     print(fmt("ISSUE", "DATE", "TICKET", "HOSTNAME", "STATE", "SEV", "TYPE", "OWNER", "UNSEEN", "CLUSTER", "ORIG", "UPD.BY", "UPD.TIME", "STATUS", "TITLE", "DESC"))
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        if 'all' in statustype:
-            cur.execute('''SELECT * FROM issues ORDER BY id ASC''')
+    for row, sibs in list_issues(statustype, filters):  #-v option
+        cttissue = (row[1])                                                                                                                                    
+        date = (row[2][0:16])                                                                                                                                  
+        severity = (row[3])                                                                                                                                    
+        ticket = (row[4])                                                                                                                                      
+        status = (row[5])                                                                                                                                      
+        cluster = (row[6])                                                                                                                                     
+        hostname = (row[7])                                                                                                                                    
+        issuetitle = (row[8])       #[:25])                                                                                                                                  
+        issuedescription = (row[9])     #in -vv option                                                                                                                       
+        assignedto = (row[10])                                                                                                                                 
+        issueoriginator = (row[11])                                                                                                                            
+        updatedby = (row[12])                                                                                                                                  
+        issuetype = (row[13])                                                                                                                                  
+        state = (row[14])                                                                                                                                      
+        updatedtime = (row[15][0:16]) 
+        viewtracker = (row[17])	#UNSEEN from list_issues()
+        cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<16}{5:<6}{6:<7}{7:<8}{8:<12}{9:<12}{10:<8}{11:<10}{12:<19}{13:<10}{14:<20}{15:<%s}" % (len(issuetitle) + 10)  #get len(issuetiel) and insert plus a few?
+        fmt = cols.format
+        if severity == 1:
+            print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                      "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                      "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription) + bcolors.ENDC)
         else:
-            cur.execute('''SELECT * FROM issues WHERE status = ? ORDER BY id ASC''', (statustype,))
-        for row in cur:  #-v option
-            cttissue = (row[1])                                                                                                                                    
-            date = (row[2][0:16])                                                                                                                                  
-            severity = (row[3])                                                                                                                                    
-            ticket = (row[4])                                                                                                                                      
-            status = (row[5])                                                                                                                                      
-            cluster = (row[6])                                                                                                                                     
-            hostname = (row[7])                                                                                                                                    
-            issuetitle = (row[8])	#[:25])                                                                                                                                  
-            issuedescription = (row[9])     #in -vv option                                                                                                                       
-            assignedto = (row[10])                                                                                                                                 
-            issueoriginator = (row[11])                                                                                                                            
-            updatedby = (row[12])                                                                                                                                  
-            issuetype = (row[13])                                                                                                                                  
-            state = (row[14])                                                                                                                                      
-            updatedtime = (row[15][0:16]) 
-            viewtracker = (row[16]) 
-            cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<16}{5:<6}{6:<7}{7:<8}{8:<12}{9:<12}{10:<8}{11:<10}{12:<19}{13:<10}{14:<20}{15:<%s}" % (len(issuetitle) + 10)  #get len(issuetiel) and insert plus a few?
-            fmt = cols.format
-            if severity == 1:
-                print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                          "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                          "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription) + bcolors.ENDC)
-            else:
-               print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                         "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                         "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription))
+           print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                     "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                     "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription))
  
-            if check_has_sibs(cttissue) is True:
-                sibs = resolve_siblings(hostname)
-                for node in sibs:
-                    if node != hostname:
-                        state = get_pbs_sib_state(node) 
-                        state = ''.join(state)
-                        issuetitle = "Sibling to %s" % (hostname)
-                        issuetype = 'o'
-                        print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                                   "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                                   "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription))
+        for node, state in sibs:
+            if node != hostname:
+                issuetitle = "Sibling to %s" % (hostname)
+                issuetype = 'o'
+                print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                           "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                           "%s" % updatedtime, "%s" % status, "%s" % issuetitle, "%s" % issuedescription))
 
 
-def get_issues_v(statustype):	# -v option
+def get_issues_v(statustype, filters=None):	# -v option
     cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<16}{5:<6}{6:<7}{7:<8}{8:<12}{9:<12}{10:<8}{11:<10}{12:<19}{13:<10}{14:<22}"
     fmt = cols.format
     print(fmt("ISSUE", "DATE", "TICKET", "HOSTNAME", "STATE", "SEV", "TYPE", "OWNER", "UNSEEN", "CLUSTER", "ORIG", "UPD.BY", "UPD.TIME", "STATUS", "TITLE (25 chars)"))
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        if 'all' in statustype:
-            cur.execute('''SELECT * FROM issues ORDER BY id ASC''')
+    for row, sibs in list_issues(statustype, filters):  #-v option
+        cttissue = (row[1])                                                                                                                                    
+        date = (row[2][0:16])                                                                                                                                  
+        severity = (row[3])                                                                                                                                    
+        ticket = (row[4])                                                                                                                                      
+        status = (row[5])                                                                                                                                      
+        cluster = (row[6])                                                                                                                                     
+        hostname = (row[7])                                                                                                                                    
+        issuetitle = (row[8][:25])                                                                                                                                  
+        issuedescription = (row[9])     #in -vv option                                                                                                                       
+        assignedto = (row[10])                                                                                                                                 
+        issueoriginator = (row[11])                                                                                                                            
+        updatedby = (row[12])                                                                                                                                  
+        issuetype = (row[13])                                                                                                                                  
+        state = (row[14])                                                                                                                                      
+        updatedtime = (row[15][0:16]) 
+        viewtracker = (row[17])	#UNSEEN from list_issues()
+        if severity == 1:     
+            print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                      "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                      "%s" % updatedtime, "%s" % status, "%s" % issuetitle) + bcolors.ENDC)
         else:
-            cur.execute('''SELECT * FROM issues WHERE status = ? ORDER BY id ASC''', (statustype,))
-        for row in cur:  #-v option
-            cttissue = (row[1])                                                                                                                                    
-            date = (row[2][0:16])                                                                                                                                  
-            severity = (row[3])                                                                                                                                    
-            ticket = (row[4])                                                                                                                                      
-            status = (row[5])                                                                                                                                      
-            cluster = (row[6])                                                                                                                                     
-            hostname = (row[7])                                                                                                                                    
-            issuetitle = (row[8][:25])                                                                                                                                  
-            issuedescription = (row[9])     #in -vv option                                                                                                                       
-            assignedto = (row[10])                                                                                                                                 
-            issueoriginator = (row[11])                                                                                                                            
-            updatedby = (row[12])                                                                                                                                  
-            issuetype = (row[13])                                                                                                                                  
-            state = (row[14])                                                                                                                                      
-            updatedtime = (row[15][0:16]) 
-            viewtracker = (row[16]) 
-            if severity == 1:     
-                print(bcolors.FAIL + fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                          "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                          "%s" % updatedtime, "%s" % status, "%s" % issuetitle) + bcolors.ENDC)
-            else:
-                print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                          "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                          "%s" % updatedtime, "%s" % status, "%s" % issuetitle))
+            print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                      "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                      "%s" % updatedtime, "%s" % status, "%s" % issuetitle))
                 
-            if check_has_sibs(cttissue) is True:
-                sibs = resolve_siblings(hostname)
-                for node in sibs:
-                    if node != hostname:
-                        state = get_pbs_sib_state(node) 
-                        state = ''.join(state)
-                        issuetitle = "Sibling to %s" % (hostname)
-                        issuetype = 'o'
-                        print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
-                                   "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
-                                   "%s" % updatedtime, "%s" % status, "%s" % issuetitle))
+        for node, state in sibs:
+            if node != hostname:
+                issuetitle = "Sibling to %s" % (hostname)
+                issuetype = 'o'
+                print(fmt("%s" % cttissue, "%s" % date, "%s" % ticket, "%s" % hostname, "%s" % state, "%s" % severity, \
+                           "%s" % issuetype, "%s" % assignedto, "%s" % viewtracker, "%s" % cluster, "%s" % issueoriginator, "%s" % updatedby, \
+                           "%s" % updatedtime, "%s" % status, "%s" % issuetitle))
 
 
 def issue_open_check(cttissue):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'open'))
-        data = cur.fetchone()
-        if data is None:
-            return False
-        else:
-            return True
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'open'))
+    data = cur.fetchone()
+    if data is None:
+        return False
+    else:
+        return True
 
 
 def issue_closed_check(cttissue):	#TO DO LATER: CHANGE ALL THE issue_xxxx_check functions to get_issue_status(cttissue,STATUS) and return True||False
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'closed'))
-        data = cur.fetchone()
-        if data is None:
-            return False
-        else:
-            return True
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'closed'))
+    data = cur.fetchone()
+    if data is None:
+        return False
+    else:
+        return True
 
 
 def issue_deleted_check(cttissue):	#checks if cttissue is deleted
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'deleted'))
-        data=cur.fetchone()
-        if data is None:
-            return False
-        else:
-            return True
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT rowid FROM issues WHERE cttissue = ? and status = ?''', (cttissue, 'deleted'))
+    data=cur.fetchone()
+    if data is None:
+        return False
+    else:
+        return True
 
 
 def delete_issue(cttissue): #check to make sure admin only runs this???    Add sib check and close sibs if deleting???
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('deleted', cttissue))
-            #print("Issue %s deleted" % (cttissue)) #jon1
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('deleted', cttissue))
+        #print("Issue %s deleted" % (cttissue)) #jon1
+
+
+def pbsnodes_cmd(option, nodes):	#one pbsnodes call on pbsadmin for all nodes
+    return "{0} -t30 -w {1} -qS -t30 -u120 '{2} {3} {4}'".format(clush_path, pbsadmin, pbsnodes_path, option, ' '.join(nodes))
+
+
+def node_flags_cmd(nodes):	#one clush over all nodes to clear the flag files
+    return "{0} -t30 -u60 -w {1} '[ -f /etc/nolocal ] && /usr/bin/unlink /etc/nolocal ; [ -f /etc/THIS_IS_A_BAD_NODE.ncar ] && /usr/bin/unlink /etc/THIS_IS_A_BAD_NODE.ncar; exit 0'".format(clush_path, ','.join(nodes))
+
+
+def failed_nodes(result, nodes):	#the nodes a batched command failed on, pbsnodes and clush name them on stderr
+    if result.timedout:
+        return set(nodes)
+    failed = set(node for node in nodes if re.search(r'\b%s\b' % (re.escape(node)), result.stderr))
+    if not failed and result.returncode != 0:	#ssh or clush failure, nothing says which nodes
+        failed = set(nodes)
+    return failed
+
+
+def pbsnodes_batch(option, nodes, deadline=None):	#returns the set of nodes pbsnodes failed on
+    if not nodes:
+        return set()
+    return failed_nodes(run_cmd(pbsnodes_cmd(option, nodes), time_left(160, deadline)), nodes)
+
+
+def resume_nodes(nodes2resume):	#returns (nodes pbsnodes -r failed on, nodes the flag files are still on)
+    if not nodes2resume:
+        return set(), set()
+    #pbsnodes -r on pbsadmin and the flag file cleanup on the nodes do not depend on each other
+    resumed, cleared = run_cmds([pbsnodes_cmd('-r -C ""', nodes2resume), node_flags_cmd(nodes2resume)], 160, \
+                                maxcommands=maxcommands)
+    return failed_nodes(resumed, nodes2resume), failed_nodes(cleared, nodes2resume)
+
+
+def log_resume(cttissue,date,updatedby,node,failed,notcleared):
+    if node in failed:
+        print('Can not process pbs_resume() on %s' % (node))
+        log_history(cttissue, date, updatedby, 'ctt failed to resume %s' % (node))
+    else:
+        log_history(cttissue, date, updatedby, 'ctt resumed %s' % (node))
+    if node in notcleared:
+        print('Can not unlink /etc/nolocal or /etc/THIS_IS_A_BAD_NODE.ncar on %s' % (node))
+        log_history(cttissue, date, updatedby, 'ctt can not unlink /etc/nolocal or /etc/THIS_IS_A_BAD_NODE.ncar on %s' % (node))
+
+
+def log_drain(cttissue,date,updatedby,node,failed):
+    if node in failed:
+        print('Can not process pbs_drain() on %s' % (node))
+        log_history(cttissue, date, updatedby, 'Failed to drain %s' % (node))
+    else:
+        log_history(cttissue, date, updatedby, 'Drained %s' % (node))
+
+
+#ctt --batch queues drains and resumes here instead of running them, pbs_flush() runs the
+#whole batch's worth as one pbsnodes -o and one resume after the batch is committed.
+#pbsnodes and clush can take minutes, no ctt runs them while it holds the sqlite write lock.
+pbs_queue = None
+
+def pbs_defer():
+    global pbs_queue
+    pbs_queue = []
+
+
+def pbs_flush(deadline=None):
+    global pbs_queue
+    queue = pbs_queue or []
+    pbs_queue = None
+    session_commit()	#whatever queued them is kept, other ctt commands can write while pbsnodes runs
+    final = {}	#a later operation in the batch wins, drain then resume is a resume
+    for op, cttissue, date, updatedby, nodes in queue:
+        for node in nodes:
+            final[node] = op
+    failed = pbsnodes_batch('-o', sorted(node for node in final if final[node] == 'drain'), deadline)
+    notresumed, notcleared = resume_nodes(sorted(node for node in final if final[node] == 'resume'))
+    for op, cttissue, date, updatedby, nodes in queue:
+        for node in nodes:
+            if final[node] != op:
+                continue
+            if op == 'drain':
+                log_drain(cttissue,date,updatedby,node,failed)
+            else:
+                log_resume(cttissue,date,updatedby,node,notresumed,notcleared)
 
 
 def pbs_resume(cttissue,date,updatedby,nodes2resume):
+    nodes2resume = sorted(node for node in nodes2resume if node != 'FATAL')
+    if not nodes2resume:
+        return
+    if pbs_queue is not None:
+        pbs_queue.append(('resume', cttissue, date, updatedby, nodes2resume))
+        return
+    session_commit()
+    failed, notcleared = resume_nodes(nodes2resume)
     for node in nodes2resume:
-        if node is 'FATAL':
-            next
-        else:
-            try:
-                os.popen("{0} -t30 -w {1} -qS -t30 -u120 '{2} -r -C \"\" {3}'".format(clush_path, pbsadmin, pbsnodes_path, node)).read()
-            except:
-                print('Can not process pbs_resume() on %s' % (node))
+        log_resume(cttissue,date,updatedby,node,failed,notcleared)
 
-            try:
-                os.popen("{0} -t30 -w {1} '[ -f /etc/nolocal ] && /usr/bin/unlink /etc/nolocal ; [ -f /etc/THIS_IS_A_BAD_NODE.ncar ] && /usr/bin/unlink /etc/THIS_IS_A_BAD_NODE.ncar;' 2>/dev/null".format(clush_path, node))
-            except:
-                print('Can not unlink /etc/nolocal or /etc/THIS_IS_A_BAD_NODE.ncar on %s' % (node))
 
-            log_history(cttissue, date, updatedby, 'ctt resumed %s' % (node))
+def pbs_drain_issues(issuenodes,date,updatedby):	#[(cttissue, node), ...], one pbsnodes -o for them all
+    issuenodes = [(cttissue, node) for cttissue, node in issuenodes if node != 'FATAL']
+    if pbs_queue is not None:
+        pbs_queue.extend(('drain', cttissue, date, updatedby, [node]) for cttissue, node in issuenodes)
+        return
+    session_commit()
+    failed = pbsnodes_batch('-o', [node for cttissue, node in issuenodes])
+    for cttissue, node in issuenodes:
+        log_drain(cttissue,date,updatedby,node,failed)
 
 
 def pbs_drain(cttissue,date,updatedby,nodes2drain):
+    nodes2drain = [node for node in nodes2drain if node != 'FATAL']
+    if pbs_queue is not None:
+        pbs_queue.append(('drain', cttissue, date, updatedby, nodes2drain))
+        return
+    session_commit()
+    failed = pbsnodes_batch('-o', nodes2drain)
     for node in nodes2drain:
-        try:
-            os.popen("{0} -t30 -w {1} -qS -t30 -u120 '{2} -o {3}'".format(clush_path, pbsadmin, pbsnodes_path, node)).read()
-        except:
-            print('Can not process pbs_drain() on %s' % (node))
-
-        log_history(cttissue, date, updatedby, 'Drained %s' % (node))    
+        log_drain(cttissue,date,updatedby,node,failed)
 
 def close_issue(cttissue, date, updatedby):
     if issue_open_check(cttissue) is False: #added this check 2/2/2021, Jon
         print("Issue %s is not open" % (cttissue))
-        exit()
+        exit(1)
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True and check_for_siblings(cttissue) is False:	#no siblings attached to cttissue
         node = get_hostname(cttissue)
         node = ''.join(node)
         nodes2resume = []
         nodes2resumeA = []
         nodes2resumeB = []
-        con = SQL.connect('ctt.sqlite')
-        with con:				#1. Another issue with same node?
-            cur = con.cursor()
-            cur.execute('''SELECT rowid FROM issues WHERE hostname = ? and status = ? and cttissue != ?''', (node, 'open', cttissue,))
-            data = cur.fetchone()
-            if data is None:
-                nodes2resumeA.append(node)   #No other issue with this node
-                next 
-            else:
-                print('There is another issue for this node. Closing issue, but not resuming.')
-                cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
-                cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+        con = get_con()
+        cur = con.cursor()	#1. Another issue with same node?
+        cur.execute('''SELECT rowid FROM issues WHERE hostname = ? and status = ? and cttissue != ?''', (node, 'open', cttissue,))
+        data = cur.fetchone()
+        if data is None:
+            nodes2resumeA.append(node)   #No other issue with this node
+            next 
+        else:
+            print('There is another issue for this node. Closing issue, but not resuming.')
+            cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+            cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
         
-        with con:				#2. In siblings table as sibling for a different issue?
-            cur = con.cursor()
-            cur.execute('''SELECT rowid FROM siblings WHERE cttissue != ? and status = ? and sibling = ?''', (cttissue, 'open', node,))
-            data = cur.fetchone()
-            if data is None:
-                nodes2resumeB.append(node)
-                cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
-                cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
-                #print("Issue %s closed" % (cttissue))                
-            else:
-                print('This node is a sibling to another issue. Closing issue, but not resuming.')
-                cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
-                cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
-                #print("Issue %s closed" % (cttissue))
+        cur = con.cursor()	#2. In siblings table as sibling for a different issue?
+        cur.execute('''SELECT rowid FROM siblings WHERE cttissue != ? and status = ? and sibling = ?''', (cttissue, 'open', node,))
+        data = cur.fetchone()
+        if data is None:
+            nodes2resumeB.append(node)
+            cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
+            cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+            #print("Issue %s closed" % (cttissue))                
+        else:
+            print('This node is a sibling to another issue. Closing issue, but not resuming.')
+            cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
+            cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+            #print("Issue %s closed" % (cttissue))
 
         #print("nodes2resumeA: %s" % (nodes2resumeA))
         #print("nodes2resumeB: %s" % (nodes2resumeB))
@@ -928,34 +1510,31 @@ def close_issue(cttissue, date, updatedby):
         nodes2resume = []
         nodes2resumeA = []
         nodes2resumeB = []
-        con = SQL.connect('ctt.sqlite')
+        con = get_con()
         for sibnode in allnodes:
-            with con:			 
-                cur = con.cursor()
-                cur.execute('''SELECT rowid FROM siblings WHERE sibling = ? and status = ? and cttissue != ?''', (sibnode, 'open', cttissue,))
-                data = cur.fetchone()
-                if data is None:
-                    nodes2resumeA.append(sibnode)
-                else:
-                    print('%s is a sibling for another issue. No nodes will be resumed, but issue will be closed.' % (sibnode))
-                    cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
-                    cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
-                    #print("Issue %s closed." % (cttissue)) #jon1
-
-            with con:		#4. If has siblings/allnodes  attached, Do the siblings have a cttissue?
-                cur = con.cursor()
-                cur.execute('''SELECT rowid FROM issues WHERE cttissue != ? and status = ? and hostname = ?''', (cttissue, 'open', sibnode,))
-                data = cur.fetchone()
-                if data is None:
-                    nodes2resumeB.append(sibnode) 
-                else:
-                    print('Can not resume %s. Sibnode has another issue.' % (sibnode))
-
-    with con:
-        cur = con.cursor()
-        cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
-        cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
-        #print("Issue %s closed" % (cttissue))  #jon1
+            cur = con.cursor()
+            cur.execute('''SELECT rowid FROM siblings WHERE sibling = ? and status = ? and cttissue != ?''', (sibnode, 'open', cttissue,))
+            data = cur.fetchone()
+            if data is None:
+                nodes2resumeA.append(sibnode)
+            else:
+                print('%s is a sibling for another issue. No nodes will be resumed, but issue will be closed.' % (sibnode))
+                cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
+                cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+                #print("Issue %s closed." % (cttissue)) #jon1
+
+            cur = con.cursor()	#4. If has siblings/allnodes  attached, Do the siblings have a cttissue?
+            cur.execute('''SELECT rowid FROM issues WHERE cttissue != ? and status = ? and hostname = ?''', (cttissue, 'open', sibnode,))
+            data = cur.fetchone()
+            if data is None:
+                nodes2resumeB.append(sibnode) 
+            else:
+                print('Can not resume %s. Sibnode has another issue.' % (sibnode))
+
+    cur = con.cursor()
+    cur.execute('''UPDATE siblings SET status = ? WHERE cttissue = ?''', ('closed', cttissue))                                   
+    cur.execute('''UPDATE issues SET status = ? WHERE cttissue = ?''', ('closed', cttissue))
+    #print("Issue %s closed" % (cttissue))  #jon1
 
     #print("A before: %s" % (nodes2resumeA))
     #print("B before: %s" % (nodes2resumeB))
@@ -970,14 +1549,13 @@ def close_issue(cttissue, date, updatedby):
         print("pbs_enforcement is False. Not resuming nodes")
 
 def check_for_siblings(cttissue):
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT * from siblings WHERE cttissue = ? and status = ?''', (cttissue, 'open',))
-        if cur.fetchone() is None:
-            return False	#no siblings
-        else:
-            return True     #has siblings
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT * from siblings WHERE cttissue = ? and status = ?''', (cttissue, 'open',))
+    if cur.fetchone() is None:
+        return False        #no siblings
+    else:
+        return True     #has siblings
 
 
 def assign_issue(cttissue, assignto):	#DONT THINK THIS FUNCTION IS USED ANY LONGER #assign to another person 
@@ -985,118 +1563,375 @@ def assign_issue(cttissue, assignto):	#DONT THINK THIS FUNCTION IS USED ANY LONG
         print("%s not a valid group, Exiting!" % (assignto))
         exit(1)
     if issue_deleted_check(cttissue) is False and issue_exists_check(cttissue) is True:
-        con = SQL.connect('ctt.sqlite')
-        with con:
-            cur = con.cursor()
-            cur.execute('''UPDATE issues SET assignedto = ? WHERE cttissue = ?''', (assignto, cttissue))
-            #print("Issue %s assigned to %s" % (cttissue, assignto))   #jon1 
+        con = get_con()
+        cur = con.cursor()
+        cur.execute('''UPDATE issues SET assignedto = ? WHERE cttissue = ?''', (assignto, cttissue))
+        #print("Issue %s assigned to %s" % (cttissue, assignto))   #jon1 
     else:
         print("Issue %s not found or deleted" % (cttissue))
 
 
 def get_new_cttissue():		#generates/gets the next cttissue number
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT * FROM issues ORDER BY rowid DESC LIMIT 1''')
-        for row in cur:
-            return int(row[1]) + 1
+    con = get_con()
+    if not con.in_transaction:	#take the write lock before reading the last number, so no other ctt can use it
+        con.execute('''BEGIN IMMEDIATE''')
+    cur = con.cursor()
+    cur.execute('''SELECT * FROM issues ORDER BY rowid DESC LIMIT 1''')
+    for row in cur:
+        return int(row[1]) + 1
 
 
 def new_issue(date,severity,ticket,status,cluster,hostname,issuetitle, \
 		issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,UserGroup):
-    cttissue = get_new_cttissue()
-    print("Issue %s opened" % (cttissue))
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''INSERT INTO issues(
-		cttissue,date,severity,ticket,status,
-                cluster,hostname,issuetitle,issuedescription,assignedto,
-                issueoriginator,updatedby,issuetype,state,updatedtime)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                (cttissue, date, severity, ticket, status, cluster, hostname, 
-                    issuetitle, issuedescription, assignedto, issueoriginator, 
-                    updatedby, issuetype, state, updatedtime))
+    return new_issues(date,severity,ticket,status,cluster,hostname.split(' '),issuetitle, \
+                      issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,UserGroup)[0] #for log_history
 
-    view_tracker_new(cttissue,UserGroup,viewnotices)
+
+def new_issues(date,severity,ticket,status,cluster,hostnames,issuetitle, \
+		issuedescription,assignedto,issueoriginator,updatedby,issuetype,state,updatedtime,UserGroup):
+    #one issue per node in hostnames, numbered in a row, inserted together and drained with one pbsnodes -o
+    first = get_new_cttissue()
+    cttissues = [first + i for i in range(len(hostnames))]
+    con = get_con()
+    cur = con.cursor()
+    cur.executemany('''INSERT INTO issues(
+            cttissue,date,severity,ticket,status,
+            cluster,hostname,issuetitle,issuedescription,assignedto,
+            issueoriginator,updatedby,issuetype,state,updatedtime)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+            [(cttissue, date, severity, ticket, status, cluster, hostname, 
+                issuetitle, issuedescription, assignedto, issueoriginator, 
+                updatedby, issuetype, state, updatedtime) for cttissue, hostname in zip(cttissues, hostnames)])
+    cur.executemany('''INSERT OR IGNORE INTO issue_tickets(cttissue, ticket) VALUES(?, ?)''', \
+                    [(cttissue, t) for cttissue in cttissues for t in split_tickets(ticket)])
+    cur.executemany('''INSERT OR REPLACE INTO issue_views(cttissue, usergroup, last_seen) VALUES(?, ?, ?)''', \
+                    [(cttissue, UserGroup, updatedtime) for cttissue in cttissues])	#view_tracker_new() for a new issue
+    for cttissue in cttissues:
+        print("Issue %s opened" % (cttissue))
 
     if pbs_enforcement == "True":
-        nodes2drain = hostname.split(' ')
-        pbs_drain(cttissue,date,updatedby,nodes2drain)
+        pbs_drain_issues(list(zip(cttissues, hostnames)),date,updatedby)
     else:
         print("pbs_enforcement is False. Not draining nodes")
 
-    return cttissue #for log_history
+    return cttissues
 
 
 def checkdb(date):		#checks the ctt db if tables and/or db itself exists. Creates if not
     cttissuestart = 1000 	#the start number for cttissues     
-    con = SQL.connect('ctt.sqlite')
-    with con:
-        cur = con.cursor()
-        cur.execute('''SELECT name FROM sqlite_master WHERE type="table" AND name="issues"''')
-        if cur.fetchone() is None:
-            cur.execute('''CREATE TABLE IF NOT EXISTS issues(
-		    id INTEGER PRIMARY KEY,
-		    cttissue TEXT NOT NULL,
-		    date TEXT NOT NULL,
-		    severity INT NOT NULL,
-		    ticket TEXT,
-		    status TEXT NOT NULL,
-		    cluster TEXT NOT NULL,
-		    hostname TEXT NOT NULL,
-		    issuetitle TEXT NOT NULL,
-		    issuedescription TEXT NOT NULL,
-		    assignedto TEXT,
-		    issueoriginator TEXT NOT NULL,
-		    updatedby TEXT NOT NULL,
-                    issuetype TEXT NOT NULL,
-                    state TEXT,
-                    updatedtime TEXT,
-                    viewtracker TEXT)''')
-
-            # Set first row in issues table
-            cur.execute('''INSERT INTO issues(	
-		    cttissue,date,severity,ticket,status,
-		    cluster,hostname,issuetitle,issuedescription,assignedto,
-		    issueoriginator,updatedby,issuetype,state,updatedtime,viewtracker)
-		    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-		    (cttissuestart, date, 99, "---", "---", "---", "---", 
-			"---", "Created table", "---", "---", "---", "---", "---", "---", "---"))
- 
-    with con:
-        cur = con.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS comments(
-                id INTEGER PRIMARY KEY,
-                cttissue TEXT NOT NULL,
-                date TEXT NOT NULL,
-                updatedby TEXT NOT NULL,
-                comment TEXT NOT NULL)''')
-
-    with con:
-        cur = con.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS history(
-                id INTEGER PRIMARY KEY,
-		cttissue TEXT NOT NULL,
-		date TEXT NOT NULL,
-                updatedby TEXT NOT NULL,
-		info TEXT)''')
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''PRAGMA user_version''')
+    version = cur.fetchone()[0]
+    if version == len(migrations):	#schema is current, nothing to create or migrate
+        cur.execute('''SELECT 1 FROM sqlite_master WHERE type = 'index' AND name IN ('issues_cttissue', 'issues_cttissue_dups')''')
+        if cur.fetchone() is None:	#issues_cttissue_dups was dropped after the duplicates were fixed
+            unique_cttissue(cur)
+        return
 
-    with con:
-        cur = con.cursor()	# 1 | 1241 | open | r1i5n24 | r1i5n10 | down
-        cur.execute('''CREATE TABLE IF NOT EXISTS siblings(
+    cur.execute('''SELECT name FROM sqlite_master WHERE type="table" AND name="issues"''')
+    if cur.fetchone() is None:
+        cur.execute('''CREATE TABLE IF NOT EXISTS issues(
                 id INTEGER PRIMARY KEY,
                 cttissue TEXT NOT NULL,
                 date TEXT NOT NULL,
+                severity INT NOT NULL,
+                ticket TEXT,
                 status TEXT NOT NULL,
-                parent TEXT NOT NULL,
-                sibling TEXT NOT NULL,
-				state TEXT)''')
+                cluster TEXT NOT NULL,
+                hostname TEXT NOT NULL,
+                issuetitle TEXT NOT NULL,
+                issuedescription TEXT NOT NULL,
+                assignedto TEXT,
+                issueoriginator TEXT NOT NULL,
+                updatedby TEXT NOT NULL,
+                issuetype TEXT NOT NULL,
+                state TEXT,
+                updatedtime TEXT,
+                viewtracker TEXT)''')
+
+        # Set first row in issues table
+        cur.execute('''INSERT INTO issues(  
+                cttissue,date,severity,ticket,status,
+                cluster,hostname,issuetitle,issuedescription,assignedto,
+                issueoriginator,updatedby,issuetype,state,updatedtime,viewtracker)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+                (cttissuestart, date, 99, "---", "---", "---", "---", 
+                    "---", "Created table", "---", "---", "---", "---", "---", "---", "---"))
+ 
+    cur = con.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS comments(
+            id INTEGER PRIMARY KEY,
+            cttissue TEXT NOT NULL,
+            date TEXT NOT NULL,
+            updatedby TEXT NOT NULL,
+            comment TEXT NOT NULL)''')
 
+    cur = con.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS history(
+            id INTEGER PRIMARY KEY,
+            cttissue TEXT NOT NULL,
+            date TEXT NOT NULL,
+            updatedby TEXT NOT NULL,
+            info TEXT)''')
+
+    cur = con.cursor()      # 1 | 1241 | open | r1i5n24 | r1i5n10 | down
+    cur.execute('''CREATE TABLE IF NOT EXISTS siblings(
+            id INTEGER PRIMARY KEY,
+            cttissue TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            parent TEXT NOT NULL,
+            sibling TEXT NOT NULL,
+                            state TEXT)''')
+
+    migrate_db(con, version)
     return
 
 
+#Schema migrations run by checkdb(). PRAGMA user_version is the number of migrations
+#already applied to ctt.sqlite, so only ever append to the migrations list.
+def migrate_db(con, version):
+    cur = con.cursor()
+    if not con.in_transaction:
+        cur.execute('''BEGIN''')	#DDL does not open a transaction on its own
+    for number in range(version, len(migrations)):
+        if migrations[number](cur) is False:
+            return	#stays at this version, retried on the next run
+        cur.execute('''PRAGMA user_version = %d''' % (number + 1))
+
+
+def migration_1_indexes(cur):	#indexes for the hot lookups by node, issue and status
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_hostname_status ON issues(hostname, status)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS siblings_sibling_status ON siblings(sibling, status)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS siblings_cttissue_status ON siblings(cttissue, status)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS history_cttissue ON history(cttissue)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS comments_cttissue ON comments(cttissue)''')
+
+
+def unique_cttissue(cur):	#one row per issue number, also the index for cttissue lookups
+    cur.execute('''SELECT cttissue FROM issues GROUP BY cttissue HAVING COUNT(*) > 1''')
+    duplicates = [row[0] for row in cur.fetchall()]
+    if duplicates:	#stderr, so --json/--csv output stays clean
+        #a plain index keeps the lookups fast and tells checkdb() not to scan again on every run
+        cur.execute('''CREATE INDEX IF NOT EXISTS issues_cttissue_dups ON issues(cttissue)''')
+        print("Duplicate issue numbers in ctt.sqlite: %s" % (', '.join(duplicates)), file=sys.stderr)
+        print("Renumber or remove the duplicates, then DROP INDEX issues_cttissue_dups and ctt adds a UNIQUE constraint on cttissue", file=sys.stderr)
+        return False
+    cur.execute('''CREATE UNIQUE INDEX IF NOT EXISTS issues_cttissue ON issues(cttissue)''')
+    return True
+
+
+def migration_2_unique_cttissue(cur):	#with duplicates the later migrations still run on a plain index
+    unique_cttissue(cur)
+
+
+def migration_3_node_fingerprints(cur):	#--auto only rechecks nodes whose fingerprint changed since the last run
+    cur.execute('''CREATE TABLE IF NOT EXISTS node_fingerprints (
+            hostname TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL)''')
+
+
+def migration_4_list_indexes(cur):	#--list -s, the --list filters and --after/--since/--until
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_status_id ON issues(status, id)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_date ON issues(date)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_cluster_status ON issues(cluster, status)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_assignedto_status ON issues(assignedto, status)''')
+
+
+#stats_summary holds the --stats -c counts (kind status, severity or node) and is kept current by
+#triggers on issues, so every insert or update of an issue moves the counts in the same transaction.
+#key has no type so severities stay integers. Rows left at 0 are skipped when read.
+def migration_5_stats_summary(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS stats_summary (
+            kind TEXT NOT NULL,
+            key NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (kind, key))''')
+    counts = {'status': 'status', 'severity': 'severity', 'node': 'hostname'}
+    add = ''.join('''
+            INSERT OR IGNORE INTO stats_summary(kind, key, count) VALUES('%s', new.%s, 0);
+            UPDATE stats_summary SET count = count + 1 WHERE kind = '%s' and key = new.%s;''' % (kind, column, kind, column) \
+            for kind, column in counts.items())
+    remove = ''.join('''
+            UPDATE stats_summary SET count = count - 1 WHERE kind = '%s' and key = old.%s;''' % (kind, column) \
+            for kind, column in counts.items())
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS stats_summary_insert AFTER INSERT ON issues
+            WHEN new.status != '---' BEGIN%s
+            END''' % (add))
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS stats_summary_update AFTER UPDATE OF status, severity, hostname ON issues
+            WHEN old.status != '---' BEGIN%s%s
+            END''' % (remove, add))
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS stats_summary_delete AFTER DELETE ON issues
+            WHEN old.status != '---' BEGIN%s
+            END''' % (remove))
+    rebuild_stats_summary(cur)
+
+
+def rebuild_stats_summary(cur):	#recount stats_summary from issues, ctt --stats --rebuild
+    cur.execute('''DELETE FROM stats_summary''')
+    for kind, column in (('status', 'status'), ('severity', 'severity'), ('node', 'hostname')):
+        cur.execute('''INSERT INTO stats_summary(kind, key, count)
+                SELECT ?, %s, COUNT(*) FROM issues WHERE status != ? GROUP BY %s''' % (column, column), (kind, '---'))
+
+
+#the history rows --stats --mttr and --reliability read, the same WHERE has to be used to hit the index
+lifecycle_where = '''(history.info = 'new issue' or history.info LIKE 'closed issue: %' or history.info LIKE 'reopened issue: %')'''
+
+def migration_6_history_lifecycle(cur):	#partial index, only the new/closed/reopened rows of history
+    cur.execute('''CREATE INDEX IF NOT EXISTS history_lifecycle ON history(cttissue, date) WHERE %s''' % (lifecycle_where))
+
+
+#ctt --search: FTS5 tables over the text columns, external content so the text is not stored twice.
+#Triggers keep them in step with every insert, update and delete on the real tables.
+fulltext = {'issues': ('issuetitle', 'issuedescription'), 'comments': ('comment',), 'history': ('info',)}
+
+def fts5_available(cur):
+    try:
+        cur.execute('''CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)''')
+        cur.execute('''DROP TABLE temp.fts5_probe''')
+        return True
+    except SQL.OperationalError:
+        return False
+
+
+def migration_7_fulltext(cur):
+    if fts5_available(cur) is False:	#sqlite built without FTS5, --search falls back to LIKE
+        return
+    for table, columns in fulltext.items():
+        cols = ', '.join(columns)
+        newcols = ', '.join('new.%s' % (col) for col in columns)
+        oldcols = ', '.join('old.%s' % (col) for col in columns)
+        cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS %s_fts USING fts5(%s, content='%s', content_rowid='id')''' % (table, cols, table))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS %s_fts_insert AFTER INSERT ON %s BEGIN
+                INSERT INTO %s_fts(rowid, %s) VALUES(new.id, %s);
+                END''' % (table, table, table, cols, newcols))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS %s_fts_delete AFTER DELETE ON %s BEGIN
+                INSERT INTO %s_fts(%s_fts, rowid, %s) VALUES('delete', old.id, %s);
+                END''' % (table, table, table, table, cols, oldcols))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS %s_fts_update AFTER UPDATE OF %s ON %s BEGIN
+                INSERT INTO %s_fts(%s_fts, rowid, %s) VALUES('delete', old.id, %s);
+                INSERT INTO %s_fts(rowid, %s) VALUES(new.id, %s);
+                END''' % (table, cols, table, table, table, cols, oldcols, table, cols, newcols))
+        cur.execute('''INSERT INTO %s_fts(%s_fts) VALUES('rebuild')''' % (table, table))
+
+
+def migration_8_issue_views(cur):	#read tracking per group, replaces the '.'-joined viewtracker column
+    cur.execute('''CREATE TABLE IF NOT EXISTS issue_views (
+            cttissue TEXT NOT NULL,
+            usergroup TEXT NOT NULL,
+            last_seen TEXT,
+            PRIMARY KEY (cttissue, usergroup))''')
+    for group in usersdict:	#every group viewtracker does not list as unseen has seen the issue
+        cur.execute('''INSERT OR IGNORE INTO issue_views(cttissue, usergroup, last_seen)
+                SELECT cttissue, ?, updatedtime FROM issues
+                WHERE '.' || ifnull(viewtracker, '') || '.' NOT LIKE '%.' || ? || '.%' ''', (group, group))
+
+
+def migration_9_issue_tickets(cur):	#external tickets out of the ','-joined issues.ticket column
+    cur.execute('''CREATE TABLE IF NOT EXISTS issue_tickets (
+            id INTEGER PRIMARY KEY,
+            cttissue TEXT NOT NULL,
+            ticket TEXT NOT NULL,
+            UNIQUE (cttissue, ticket))''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS issue_tickets_ticket ON issue_tickets(ticket)''')
+    cur.execute('''SELECT cttissue, ticket FROM issues WHERE ticket != ? ORDER BY id ASC''', ('---',))
+    rows = [(cttissue, t) for cttissue, ticket in cur.fetchall() for t in split_tickets(ticket)]
+    cur.executemany('''INSERT OR IGNORE INTO issue_tickets(cttissue, ticket) VALUES(?, ?)''', rows)
+
+
+def migration_10_filter_indexes(cur):	#--list --severity and --type, like the cluster and assignedto indexes
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_severity_status ON issues(severity, status)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS issues_issuetype_status ON issues(issuetype, status)''')
+
+
+migrations = [
+    migration_1_indexes,
+    migration_2_unique_cttissue,
+    migration_3_node_fingerprints,
+    migration_4_list_indexes,
+    migration_5_stats_summary,
+    migration_6_history_lifecycle,
+    migration_7_fulltext,
+    migration_8_issue_views,
+    migration_9_issue_tickets,
+    migration_10_filter_indexes,
+]
+
+
+def fts_query(words):	#each word quoted so P2-DIMM1G or r1i1n1 are not read as fts5 syntax, word* stays a prefix
+    terms = []
+    for word in words:
+        prefix = word.endswith('*') and len(word) > 1
+        term = '"%s"' % (word.rstrip('*').replace('"', '""'))
+        terms.append(term + ' *' if prefix else term)
+    return ' '.join(terms)
+
+
+def search_issues(words, statustype='all', since=None, limit=50):	#ctt --search, [(cttissue, found in, snippet), ...]
+    #An issue is listed once, by where it matched first: its title or description, then a comment,
+    #then history. bm25() scores are only comparable within one fts table, so they order the issues
+    #within each of those tiers and the newest issue wins a tie.
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT name FROM sqlite_master WHERE type = ? and name = ?''', ('table', 'issues_fts'))
+    if cur.fetchone() is not None:
+        query = fts_query(words)
+        hits = '''SELECT issues.cttissue, 0, bm25(issues_fts), 'issue', snippet(issues_fts, -1, '[', ']', '...', 10)
+                FROM issues_fts JOIN issues ON issues.id = issues_fts.rowid WHERE issues_fts MATCH ?
+                UNION ALL
+                SELECT comments.cttissue, 1, bm25(comments_fts), 'comment', snippet(comments_fts, 0, '[', ']', '...', 10)
+                FROM comments_fts JOIN comments ON comments.id = comments_fts.rowid WHERE comments_fts MATCH ?
+                UNION ALL
+                SELECT history.cttissue, 2, bm25(history_fts), 'history', snippet(history_fts, 0, '[', ']', '...', 10)
+                FROM history_fts JOIN history ON history.id = history_fts.rowid WHERE history_fts MATCH ?'''
+        params = [query, query, query]
+    else:	#no FTS5 in this sqlite, same tiers from LIKE scans without a score
+        like = ' and '.join(['%s LIKE ?'] * len(words))
+        hits = '''SELECT cttissue, 0, 0, 'issue', issuetitle FROM issues WHERE (%s) or (%s)
+                UNION ALL
+                SELECT cttissue, 1, 0, 'comment', comment FROM comments WHERE %s
+                UNION ALL
+                SELECT cttissue, 2, 0, 'history', info FROM history WHERE %s''' % \
+                (like % (('issuetitle',) * len(words)), like % (('issuedescription',) * len(words)), \
+                 like % (('comment',) * len(words)), like % (('info',) * len(words)))
+        params = ['%%%s%%' % (word.rstrip('*')) for word in words] * 4
+    where = ''
+    if 'all' not in statustype:
+        where = where + ' and issues.status = ?'
+        params.append(statustype)
+    if since:
+        where = where + ' and issues.date >= ?'
+        params.append(since)
+    #best is each issue's first tier, matches its best scored hit in that tier (sqlite takes found
+    #and snippet from the MIN(rank) row)
+    cur.execute('''WITH hits(cttissue, tier, rank, found, snippet) AS (%s),
+             best AS (SELECT cttissue, MIN(tier) AS tier FROM hits GROUP BY cttissue),
+             matches AS (SELECT hits.cttissue, hits.tier, MIN(hits.rank) AS rank, hits.found, hits.snippet
+                 FROM hits JOIN best ON best.cttissue = hits.cttissue and best.tier = hits.tier GROUP BY hits.cttissue)
+             SELECT matches.cttissue, issues.date, issues.status, issues.hostname, matches.found, matches.snippet
+             FROM matches JOIN issues ON issues.cttissue = matches.cttissue
+             WHERE issues.status != '---'%s ORDER BY matches.tier, matches.rank, issues.id DESC LIMIT ?''' % (hits, where), params + [limit])
+    return cur
+
+
+def get_search(words, statustype='all', since=None, limit=50, outformat=None):	#used for the --search option
+    try:
+        results = search_issues(words, statustype, since, limit)
+    except SQL.OperationalError as err:
+        print("Can not search for %s: %s" % (' '.join(words), err))
+        exit(1)
+    if outformat:
+        write_records(outformat, ('cttissue', 'date', 'status', 'hostname', 'found', 'snippet'), results)
+        return
+    cols = "{0:<8}{1:<19}{2:<9}{3:<13}{4:<9}{5}"
+    fmt = cols.format
+    print(fmt("ISSUE", "DATE", "STATUS", "HOSTNAME", "FOUND", "MATCH"))
+    for cttissue, date, status, hostname, found, snippet in results:
+        print(fmt("%s" % cttissue, "%s" % date[0:16], "%s" % status, "%s" % hostname, "%s" % found, \
+                  "%s" % ' '.join(snippet.split())[:80]))
+
+
 def show_help():
     print("Cluster Ticket Tracker Version 1.0.0")
 
@@ -1106,11 +1941,13 @@ def show_help():
 
                 ctt --open ISSUETITLE ISSUEDESC -n NODE
                 # You may open multiple issues with a comma separated list such as r1i1n1,r4i3n12,++
+                # or a node set such as r1i[0-3]n[0-17] or casper[01-36], one issue per node.
 
                 Examples:
                 ctt --open "Persistent memory errors" "Please open HPE ticket for persistent memory errors on P2-DIMM1G" -n r1i1n1
                 ctt --open "Will not boot" "Please open a severity 1 HPE ticket to determine why this node will not boot" -n r1i1n1 -a casg -s1
                 ctt --open "Persistent memory errors" "Persistent memory errors on P2-DIMM1G. HPE ticket already opened" -n r1i1n1 -t HPE48207411
+                ctt --open "Rack power loss" "PDU failure on rack 1" -n r1i[0-3]n[0-17]
 
                 Optional arguments:
                 -s, --severity, Choices: {1, 2, 3, 4}
@@ -1129,6 +1966,7 @@ def show_help():
 
                 Optional Arguments:
                 -d     #Show detail/history of ticket
+                --json, --csv, --ndjson     #machine readable, includes siblings, comments and history
 
 --list
 
@@ -1138,11 +1976,52 @@ def show_help():
                 ctt --list
                 ctt --list -vv
                 ctt --list -s closed -v
+                ctt --list -s all --since 2021-01-01 --until 2021-02-01 -c casper
+                ctt --list -s all --limit 50 --after 1050
 
                 Optional Arguments:
                 -v
                 -vv
                 -s, Choices: {Open, Closed, All}
+                --limit, show at most this many issues
+                --after, issues after this ISSUENUMBER, for the next page of a --limit list
+                --since, --until, issues opened from --since up to, not including, --until (YYYY-MM-DD)
+                -c, --cluster, 
+                -a, --assign, 
+                --severity, Choices: {1, 2, 3, 4}
+                -x, --type, Choices: {h, s, t, u, o}
+                --unseen, only issues your group has not seen since they were last updated
+                --json, --csv, --ndjson, machine readable output, siblings included
+
+--search
+
+                ctt --search WORDS++
+                # Searches issue titles, descriptions, comments and history. Issues matched on their title or
+                # description come first, then those matched on a comment, then on history, each best match first.
+                # A title and description, comment or history entry matches when it has every word.
+                # word* matches any word starting with word.
+
+                Examples:
+                ctt --search P2-DIMM1G
+                ctt --search ECC dimm* -s open --since 2021-01-01
+
+                Optional Arguments:
+                -s, Choices: {open, closed, deleted, all}
+                --since, only issues opened on or after this date (YYYY-MM-DD)
+                --limit, most issues shown, default 50
+                --json, --csv, --ndjson
+
+--ticket
+
+                ctt --ticket TICKET
+                # Shows the issues an external ticket (see --update -t) is attached to.
+
+                Examples:
+                ctt --ticket HPE48207411
+
+                Optional Arguments:
+                -s, Choices: {open, closed, deleted, all}, default all
+                --json, --csv, --ndjson
 
 --update
 
@@ -1199,6 +2078,44 @@ def show_help():
 
                 ctt --stats
                 # The output will be in csv format.
+                # --json, --csv or --ndjson give one section,key,count record per line instead.
+
+                Examples:
+                ctt --stats -c
+                ctt --stats -c --since 2021-01-01 --until 2022-01-01 --by cluster --by month
+                ctt --stats -n r1i1n1
+                ctt --stats --mttr --since 2021-01-01
+                ctt --stats --reliability --top 20
+
+                Optional Arguments:
+                -c, --counts, issues per severity, status and node
+                -n, --node, every issue opened on a node
+                --since, --until, only issues opened from --since up to, not including, --until (YYYY-MM-DD)
+                --by, extra -c sections, repeat for more. Choices: {assignee, cluster, month, originator, type, week}
+                --rebuild, recount the stored -c totals from the issues table
+                --mttr, open to close hours (mean, median, p90, per severity) and reopen rate
+                --reliability, nodes with the most new or reopened issues and their mean days between failures
+                --top, how many nodes --reliability lists, default 10
+
+--daemon
+
+                ctt --daemon
+                # Runs --auto every daemon_interval seconds (ctt.ini) in one long running process.
+                # kill -TERM stops it after the current poll, kill -HUP rereads ctt.ini.
+                # --auto and --daemon hold ctt.auto.lock, so only one of them runs at a time, and a pass
+                # stops after auto_deadline seconds (ctt.ini), leaving what it did not finish for the next one.
+
+--batch
+
+                ctt --batch FILE
+                # Runs many ctt commands in one process and one transaction, FILE - reads stdin.
+                # One command per line, the leading ctt is optional and # starts a comment line,
+                # or a JSON list of argument lists. Drains and resumes are merged and run once at the end.
+                # A command that fails is rolled back and the rest still run.
+
+                Examples:
+                ctt --batch /tmp/maintenance.txt
+                echo '[["--close", "1028", "Node replaced"], ["--update", "1050", "-s", "2"]]' | ctt --batch -
 
     ''')
 
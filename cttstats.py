@@ -27,96 +27,215 @@
 #WHETHER IN CONTRACT, STRICT LIABILITY,
 #OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+from cttlib import get_con, write_records, usersdict, rebuild_stats_summary, lifecycle_where
 import sqlite3 as SQL
 
 
 cols = "{0:<8}{1:<19}{2:<9}{3:<11}{4:<7}{5:<8}{6:<16}{7:<19}{8:<12}{9:<28}" 
 fmt = cols.format
 
-def run_stats_node(nodevalue):
-    con = SQL.connect('ctt.sqlite')
+#--stats -c --by: section name and csv title for each breakdown, and what issues are grouped on
+breakdowns = {
+    'cluster': ('Cluster', 'cluster'),
+    'type': ('Issue type', 'issuetype'),
+    'assignee': ('Assigned to', 'assignedto'),
+    'originator': ('Issue originator', 'issueoriginator'),
+    'week': ('Week opened', "strftime('%Y-W%W', substr(date, 1, 10))"),
+    'month': ('Month opened', 'substr(date, 1, 7)'),
+}
+
+def run_stats_node(nodevalue, outformat=None):
+    con = get_con()
     cur = con.cursor()
     cur.execute('''SELECT * FROM issues WHERE hostname = ?''', (nodevalue,))
+    if outformat:
+        write_records(outformat, [col[0] for col in cur.description], cur)
+        return
     data = cur.fetchall()
 
     for row in data:
         print(row)
 
-    con.close()
 
-
-def run_stats_counts():
-    severity_list = []
-    status_list = []
-    issueoriginator_list = []
-
-    con = SQL.connect('ctt.sqlite')
+def count_by(expression, since=None, until=None):	#[(key, count), ...] with one GROUP BY, the '---' first row left out
+    where = ' WHERE status != ?'
+    params = ['---']
+    if since:
+        where = where + ' and date >= ?'
+        params.append(since)
+    if until:
+        where = where + ' and date < ?'
+        params.append(until)
+    con = get_con()
     cur = con.cursor()
-    cur.execute('''SELECT * FROM issues''')
-    data = cur.fetchall()
-    
-    for row in data:
-        date = (row[2][0:16])
-        severity = (row[3])
-        if severity:
-            severity_list.append(severity)
-        status = (row[5])
-        if status != '---':
-            status_list.append(status)
-        cluster = (row[6])
-        hostname = (row[7])
-        issuetitle = (row[8])  
-        assignedto = (row[10])
-#        issueoriginator = (row[11])
-#        if issueoriginator != '---':
-#            issueoriginator_list.append(issueoriginator)
-#        issuetype = (row[13])
-
-
-    print("\nSeverity,count")
-    print("1,%s" % severity_list.count(1))
-    print("2,%s" % severity_list.count(2))
-    print("3,%s" % severity_list.count(3))
-    print("4,%s" % severity_list.count(4))
-
-    print("\nIssue status,count")
-    print("open,%s" % status_list.count('open'))
-    print("closed,%s" % status_list.count('closed'))
-    print("deleted,%s\n" % status_list.count('deleted'))
-
-#    print("\nIssue Originator,count")
-#    print(issueoriginator_list)
-#    print("ctt,%s" % issueoriginator_list.count('ctt'))
-#    print("hsg,%s" % issueoriginator_list.count('hsg'))
-#    print("casg,%s\n" % issueoriginator_list.count('casg'))
-    
-
-    cur.execute('''SELECT hostname, COUNT(*) FROM issues GROUP BY hostname ORDER BY hostname''')
-    data = cur.fetchall()
-    print("Issues per node,count")
-    for row in data:
-        if row[0] !=  '---':
-            print("%s,%s" % (row[0], row[1]))
-
-
-
-
-
-
-
-
+    cur.execute('''SELECT %s, COUNT(*) FROM issues%s GROUP BY 1 ORDER BY 1''' % (expression, where), params)
+    return cur.fetchall()
 
 
+def originator_groups(rows):	#ctt, or the ctt.ini group of whoever opened the issue
+    counts = {}
+    for user, count in rows:
+        group = 'other'
+        if user == 'ctt':
+            group = 'ctt'
+        for name, members in usersdict.items():
+            if user in members.split():
+                group = name
+        counts[group] = counts.get(group, 0) + count
+    return sorted(counts.items())
 
 
-
-
-
-
-
-
-
-
-
-    con.close()
-
+def summary_counts():	#stats_summary as {kind: [(key, count), ...]}, a few rows however many issues there are
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT kind, key, count FROM stats_summary WHERE count > 0 ORDER BY kind, key''')
+    counts = {'status': [], 'severity': [], 'node': []}
+    for kind, key, count in cur:
+        counts.setdefault(kind, []).append((key, count))
+    return counts
+
+
+def run_stats_rebuild():	#ctt --stats --rebuild
+    con = get_con()
+    rebuild_stats_summary(con.cursor())
+    print("Rebuilt stats_summary")
+
+
+def run_stats_counts(outformat=None, since=None, until=None, by=None):
+    if since or until:	#a time window has to count the issues themselves
+        counts = {'severity': count_by('severity', since, until), 'status': count_by('status', since, until), \
+                  'node': count_by('hostname', since, until)}
+    else:
+        counts = summary_counts()
+    severities = dict(counts['severity'])
+    statuses = dict(counts['status'])
+    sections = [
+        ('severity', 'Severity', [(severity, severities.get(severity, 0)) for severity in (1, 2, 3, 4)]),
+        ('status', 'Issue status', [(status, statuses.get(status, 0)) for status in ('open', 'closed', 'deleted')]),
+        ('node', 'Issues per node', [row for row in counts['node'] if row[0] != '---']),
+    ]
+    for name in by or []:
+        title, expression = breakdowns[name]
+        rows = count_by(expression, since, until)
+        if name == 'originator':
+            rows = originator_groups(rows)
+        sections.append((name, title, rows))
+
+    if outformat:	#--json/--csv/--ndjson, one section,key,count record per line of the csv below
+        write_records(outformat, ('section', 'key', 'count'), \
+                      ((name, key, count) for name, title, rows in sections for key, count in rows))
+        return
+
+    for name, title, rows in sections:
+        if name == 'node':	#the original --stats layout, scripts read it
+            print("Issues per node,count")
+        else:
+            print("\n%s,count" % (title))
+        for key, count in rows:
+            print("%s,%s" % (key, count))
+        if name == 'status':
+            print("")
+
+
+def history_window(since, until):	#--since/--until on the date of the history row
+    where = ''
+    params = []
+    if since:
+        where = where + ' and history.date >= ?'
+        params.append(since)
+    if until:
+        where = where + ' and history.date < ?'
+        params.append(until)
+    return where, params
+
+
+def check_window_functions():	#LAG() OVER needs sqlite 3.25
+    if SQL.sqlite_version_info < (3, 25, 0):
+        print("--mttr and --reliability need sqlite 3.25 or newer, this python has %s" % (SQL.sqlite_version))
+        exit(1)
+
+
+def percentile(values, fraction):	#values sorted
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def hours(value):
+    if value is None:
+        return '---'
+    return '%.1f' % (value)
+
+
+def run_stats_mttr(outformat=None, since=None, until=None):	#ctt --stats --mttr
+    #One pass over the new/closed/reopened history rows in issue and time order. LAG() gives the row
+    #before each one, so a close that follows a new issue or a reopen is one open-to-close duration.
+    check_window_functions()
+    where, params = history_window(since, until)
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT events.cttissue, events.info, events.hours, issues.severity FROM (
+                SELECT history.cttissue, history.info, LAG(history.info) OVER win AS previnfo,
+                (julianday(history.date) - julianday(LAG(history.date) OVER win)) * 24 AS hours
+                FROM history WHERE %s%s
+                WINDOW win AS (PARTITION BY history.cttissue ORDER BY history.date, history.id)) AS events
+             JOIN issues ON issues.cttissue = events.cttissue
+             WHERE events.info LIKE 'reopened issue: %%' or (events.info LIKE 'closed issue: %%' and
+                   events.previnfo IS NOT NULL and events.previnfo NOT LIKE 'closed issue: %%')''' % (lifecycle_where, where), params)
+    durations = []
+    severities = {}	#severity: [hours, ...]
+    closed = set()
+    reopened = set()
+    reopens = 0
+    for cttissue, info, duration, severity in cur:
+        if info.startswith('reopened issue: '):
+            reopens = reopens + 1
+            reopened.add(cttissue)
+            continue
+        closed.add(cttissue)
+        durations.append(duration)
+        severities.setdefault(severity, []).append(duration)
+    durations.sort()
+    mean = sum(durations) / len(durations) if durations else None
+    sections = [
+        ('resolution', 'Time to resolution', 'hours', [('resolved', len(durations)), ('mean', hours(mean)), \
+            ('median', hours(percentile(durations, 0.5))), ('p90', hours(percentile(durations, 0.9))), \
+            ('max', hours(durations[-1] if durations else None))]),
+        ('severity', 'Mean time to resolution by severity', 'hours', \
+            [(severity, hours(sum(values) / len(values))) for severity, values in sorted(severities.items())]),
+        ('reopens', 'Reopens', 'count', [('closed issues', len(closed)), ('reopened issues', len(reopened)), \
+            ('reopens', reopens), ('reopen rate', '%.3f' % (len(reopened) / len(closed)) if closed else '---')]),
+    ]
+    if outformat:
+        write_records(outformat, ('section', 'key', 'value'), \
+                      ((name, key, value) for name, title, unit, rows in sections for key, value in rows))
+        return
+    for name, title, unit, rows in sections:
+        print("\n%s,%s" % (title, unit))
+        for key, value in rows:
+            print("%s,%s" % (key, value))
+
+
+def run_stats_reliability(outformat=None, since=None, until=None, top=10):	#ctt --stats --reliability
+    #A failure is a new issue or a reopen on a node. LAG() gives the gap to the node's previous
+    #failure, the mean gap is the node's mean time between failures.
+    check_window_functions()
+    where, params = history_window(since, until)
+    con = get_con()
+    cur = con.cursor()
+    cur.execute('''SELECT hostname, COUNT(*), MIN(date), MAX(date), AVG(gap) FROM (
+                SELECT issues.hostname, history.date,
+                julianday(history.date) - julianday(LAG(history.date) OVER (PARTITION BY issues.hostname ORDER BY history.date)) AS gap
+                FROM history JOIN issues ON issues.cttissue = history.cttissue
+                WHERE %s and history.info NOT LIKE 'closed issue: %%' and issues.hostname NOT IN (?, ?)%s)
+             GROUP BY hostname ORDER BY COUNT(*) DESC, AVG(gap) IS NULL, AVG(gap) ASC, hostname LIMIT ?''' % (lifecycle_where, where), \
+             ['---', 'FATAL'] + params + [top])
+    columns = ('hostname', 'failures', 'first', 'last', 'mtbf_days')
+    records = ((hostname, failures, first[0:16], last[0:16], '%.1f' % (mtbf) if mtbf is not None else '---') \
+               for hostname, failures, first, last, mtbf in cur)
+    if outformat:
+        write_records(outformat, columns, records)
+        return
+    print("\nWorst %s nodes,failures,first,last,mtbf days" % (top))
+    for record in records:
+        print(','.join('%s' % (value) for value in record))
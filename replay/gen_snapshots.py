@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#Copyright (c) 2020, University Corporation for Atmospheric Research
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without 
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, 
+#this list of conditions and the following disclaimer.
+#
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#3. Neither the name of the copyright holder nor the names of its contributors
+#may be used to endorse or promote products derived from this software without
+#specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+#LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+#WHETHER IN CONTRACT, STRICT LIABILITY,
+#OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+
+#Writes a synthetic pbsnodes -av -Fdsv -D, snapshot sequence for the replay harness.
+#
+#  ./replay/gen_snapshots.py DIR --nodes 10000 --steps 5
+#
+#Nodes are named r<rack>i<iru>n<node> like an SGI/HPE ICE system so sibling handling works.
+#Each step some healthy nodes fail (down/offline with a PBS comment that has escaped commas
+#and '=' in it) and some failed nodes come back. Half of the failed nodes also get a
+#THIS_IS_A_BAD_NODE.ncar reason in DIR/replay.json.
+import argparse
+import json
+import os
+import random
+
+nodes_per_iru = 36
+irus_per_rack = 8
+failed_states = ['down\\,offline', 'offline', 'state-unknown\\,down', 'down']
+reasons = ['DIMM errors on P2-DIMM1G', 'CPU=1 machine check', 'IB link flapping\\, port 1', 'will not boot']
+
+
+def node_names(count):
+    names = []
+    rack = 1
+    while len(names) < count:
+        for iru in range(irus_per_rack):
+            for node in range(nodes_per_iru):
+                names.append('r%di%dn%d' % (rack, iru, node))
+        rack += 1
+    return names[:count]
+
+
+def node_line(name, state, comment, jobs):
+    fields = ['Node=%s' % (name), 'Mom=%s.ib0' % (name), 'Port=15002', 'pbs_version=2021.1.3', 'ntype=PBS',
+              'state=%s' % (state), 'pcpus=36', 'resources_available.arch=linux', 'resources_available.host=%s' % (name),
+              'resources_available.mem=191gb', 'resources_available.ncpus=36', 'resources_available.vnode=%s' % (name),
+              'resources_assigned.ncpus=%d' % (36 if jobs else 0), 'resv_enable=True', 'sharing=default_shared']
+    if comment is not None:
+        fields.append('comment=%s' % (comment))
+    if jobs:
+        fields.append('jobs=%s' % (jobs))
+    return ','.join(fields)
+
+
+def generate(replaydir, nodes=10000, steps=5, fail_rate=0.001, recover_rate=0.3, busy_rate=0.6, seed=1):
+    rng = random.Random(seed)
+    names = node_names(nodes)
+    failed = {}	#name: (state, comment)
+    badnodes = {}
+    snapdir = os.path.join(replaydir, 'snapshots')
+    os.makedirs(snapdir, exist_ok=True)
+    for step in range(steps):
+        for name in list(failed):
+            if rng.random() < recover_rate:
+                del failed[name]
+        for name in names:
+            if name not in failed and rng.random() < fail_rate:
+                comment = None if rng.random() < 0.3 else 'ctt: %s\\, seen=%d' % (rng.choice(reasons), step)
+                failed[name] = (rng.choice(failed_states), comment)
+                if rng.random() < 0.5:
+                    badnodes[name] = rng.choice(reasons).replace('\\,', ',')
+        with open(os.path.join(snapdir, '%04d.dsv' % (step)), 'w') as f:
+            for i, name in enumerate(names):
+                if name in failed:
+                    state, comment = failed[name]
+                    f.write(node_line(name, state, comment, None) + '\n')
+                elif rng.random() < busy_rate:
+                    job = '%d.casper-pbs' % (100000 + i)
+                    f.write(node_line(name, 'job-busy', None, '\\, '.join('%s/%d' % (job, cpu) for cpu in range(4))) + '\n')
+                else:
+                    f.write(node_line(name, 'free', None, None) + '\n')
+    configpath = os.path.join(replaydir, 'replay.json')
+    config = {}
+    if os.path.exists(configpath):
+        with open(configpath) as f:
+            config = json.load(f)
+    config['badnodes'] = badnodes
+    with open(configpath, 'w') as f:
+        json.dump(config, f, indent=1)
+    return names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate pbsnodes snapshots for the ctt replay harness')
+    parser.add_argument('replaydir')
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--fail-rate', type=float, default=0.001)
+    parser.add_argument('--recover-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.replaydir, args.nodes, args.steps, args.fail_rate, args.recover_rate, seed=args.seed)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#Copyright (c) 2020, University Corporation for Atmospheric Research
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without 
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, 
+#this list of conditions and the following disclaimer.
+#
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#3. Neither the name of the copyright holder nor the names of its contributors
+#may be used to endorse or promote products derived from this software without
+#specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+#LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+#WHETHER IN CONTRACT, STRICT LIABILITY,
+#OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+
+#Offline replay harness for ctt --auto. No PBS server or clush needed.
+#
+#  ./replay/run_replay.py --nodes 10000 --steps 5
+#  ./replay/run_replay.py --snapshots /path/to/recorded/dsv/files --latency 0.2 --dead r1i0n4,r1i0n5
+#
+#Builds a scratch directory with a ctt.ini whose pbsnodes_path and clush_path point at the
+#stand-ins in this directory, runs ctt.py --auto once per snapshot and prints a JSON report:
+#wall time per run, issues opened, and every drain/resume/clush request ctt sent.
+#Recorded snapshots are plain pbsnodes -av -Fdsv -D, output, one file per poll, replayed in name order.
+import argparse
+import getpass
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+replaybin = os.path.dirname(os.path.abspath(__file__))
+ctt = os.path.join(os.path.dirname(replaybin), 'ctt.py')
+sys.path.insert(0, replaybin)
+from gen_snapshots import generate
+
+ini = '''[DEFAULTS]
+severity = 3
+issuestatus = open
+issuetype = h
+assignedto = hsg
+pbsadmin = replay-pbs
+pbsnodes_path = {pbsnodes}
+clush_path = {clush}
+attach_location = {workdir}/attachments
+cluster = replay
+maxissuesrun = {maxissues}
+maxissuesopen = {maxissues}
+strict_node_match = False
+strict_node_match_auto = False
+pbs_enforcement = True
+badnode_timeout = 30
+maxcommands = 8
+
+[USERS]
+hsg = {user}
+'''
+
+
+def setup(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ctt-replay-')
+    os.makedirs(workdir, exist_ok=True)
+    for name in ('ctt.sqlite', 'requests.log', 'cursor.json', 'overlay.json'):
+        if os.path.exists(os.path.join(workdir, name)):
+            os.unlink(os.path.join(workdir, name))
+    config = {'latency': args.latency, 'dead_nodes': [node for node in args.dead.split(',') if node],
+              'dead_delay': args.dead_delay, 'unknown_nodes': []}
+    with open(os.path.join(workdir, 'replay.json'), 'w') as f:
+        json.dump(config, f)
+    snapdir = os.path.join(workdir, 'snapshots')
+    if args.snapshots:
+        shutil.rmtree(snapdir, ignore_errors=True)
+        shutil.copytree(args.snapshots, snapdir)
+    elif not os.path.isdir(snapdir) or args.regenerate:
+        shutil.rmtree(snapdir, ignore_errors=True)
+        generate(workdir, args.nodes, args.steps, args.fail_rate, seed=args.seed)
+    with open(os.path.join(workdir, 'ctt.ini'), 'w') as f:
+        f.write(ini.format(pbsnodes=os.path.join(replaybin, 'pbsnodes'), clush=os.path.join(replaybin, 'clush'),
+                           workdir=workdir, maxissues=args.maxissues, user=getpass.getuser()))
+    return workdir
+
+
+def run_auto(workdir):
+    env = dict(os.environ, CTT_REPLAY_DIR=workdir)
+    start = time.time()
+    proc = subprocess.run([sys.executable, ctt, '--auto'], cwd=workdir, env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    return time.time() - start, proc.returncode, proc.stdout
+
+
+def report(workdir, runs):
+    requests = []
+    if os.path.exists(os.path.join(workdir, 'requests.log')):
+        with open(os.path.join(workdir, 'requests.log')) as f:
+            requests = [json.loads(line) for line in f]
+    con = sqlite3.connect(os.path.join(workdir, 'ctt.sqlite'))
+    opened = con.execute('''SELECT COUNT(*) FROM issues WHERE issueoriginator = ?''', ('ctt',)).fetchone()[0]
+    fatal = [row[0] for row in con.execute('''SELECT issuetitle FROM issues WHERE hostname = ?''', ('FATAL',))]
+    con.close()
+    ops = {}
+    for request in requests:
+        key = '%s %s' % (request['tool'], request['op'])
+        ops.setdefault(key, {'calls': 0, 'nodes': 0})
+        ops[key]['calls'] += 1
+        ops[key]['nodes'] += len(request.get('nodes', request.get('hosts', [])))
+    return {
+        'workdir': workdir,
+        'runs': runs,
+        'total_seconds': round(sum(run['seconds'] for run in runs), 3),
+        'issues_opened': opened,
+        'fatal_issues': fatal,
+        'requests': ops,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay pbsnodes snapshots through ctt --auto')
+    parser.add_argument('--workdir', help='scratch directory, default a new temporary directory')
+    parser.add_argument('--snapshots', help='directory of recorded pbsnodes -av -Fdsv -D, files')
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--fail-rate', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--regenerate', action='store_true', help='regenerate snapshots in an existing workdir')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every clush call')
+    parser.add_argument('--dead', default='', help='comma separated nodes that never answer clush')
+    parser.add_argument('--dead-delay', type=float, default=2.0)
+    parser.add_argument('--maxissues', type=int, default=100000, help='maxissuesrun and maxissuesopen for the run')
+    parser.add_argument('--verbose', action='store_true', help='include ctt output in the report')
+    args = parser.parse_args()
+
+    workdir = setup(args)
+    runs = []
+    for step in range(len(os.listdir(os.path.join(workdir, 'snapshots')))):
+        seconds, returncode, output = run_auto(workdir)
+        run = {'step': step, 'seconds': round(seconds, 3), 'returncode': returncode}
+        if args.verbose:
+            run['output'] = output
+        runs.append(run)
+    print(json.dumps(report(workdir, runs), indent=1))